@@ -1,82 +1,225 @@
 ### Discontinuous Galerkin SEM - Adapted for 1D from the single domain approximation.
 ### Written by Jack Walsh - FEB 2021
 
+import heapq
+import itertools
+import time
 import numpy as np
-from matplotlib import pyplot as plt
+from MeshGenerator import Mesh
+from Linear_regression import LinearRegression
+
+# Legendre tables shared across the process
+#           LEGENDRE_TABLES[KEY = (n, nodes)] -> [P_0..P_n, P'_0..P'_n] at the nodes #
+#           MODAL_TABLES[KEY = (N, nodes)] -> nodal-to-modal transform for N Gauss nodes #
+#           GAUSS_TABLES[KEY = N] -> (nodes, weights) of the N point Gauss rule #
+LEGENDRE_TABLES = {}
+MODAL_TABLES = {}
+GAUSS_TABLES = {}
+
+def legendre_basis(n, x):
+    # P_0..P_n and their derivatives at every point of x, rows indexed by degree
+    x = np.asarray(x, dtype='float')
+    P = np.zeros((n + 1,) + x.shape)
+    dP = np.zeros((n + 1,) + x.shape)
+    P[0] = 1.0
+    if n >= 1:
+        P[1] = x
+        dP[1] = 1.0
+    for k in range(2, n + 1):
+        P[k] = (((2 * k - 1) / k) * x * P[k - 1]) - (((k - 1) / k) * P[k - 2])
+        dP[k] = dP[k - 2] + ((2 * k - 1) * P[k - 1])
+    return P, dP
+
+def legendre_table(n, x):
+    # Memoised legendre_basis for node sets that are reused (quadrature and indicator nodes)
+    x = np.asarray(x, dtype='float')
+    key = (n, x.tobytes())
+    if key not in LEGENDRE_TABLES:
+        P, dP = legendre_basis(n, x)
+        P.setflags(write=False)
+        dP.setflags(write=False)
+        LEGENDRE_TABLES[key] = [P, dP]
+    return LEGENDRE_TABLES[key]
+
+def modal_table(LGx, LGw):
+    # a = M @ u gives the Legendre coefficients a_0..a_{N-1} of the nodal values u
+    key = (len(LGx), LGx.tobytes())
+    if key not in MODAL_TABLES:
+        N = len(LGx)
+        P = legendre_table(N - 1, LGx)[0]
+        M = ((2 * np.arange(N) + 1) / 2)[:, None] * P * LGw[None, :]
+        M.setflags(write=False)
+        MODAL_TABLES[key] = M
+    return MODAL_TABLES[key]
+
+def legendre_gauss(N):
+    # N Gauss nodes (the roots of P_N) and weights on [-1, 1], memoised per N
+    if N in GAUSS_TABLES:
+        return GAUSS_TABLES[N]
+    x = np.zeros(N, dtype='float')
+    w = np.zeros(N, dtype='float')
+
+    if (N == 1):
+        x[0] = 0.0
+        w[0] = 2.0
+    else:
+
+        # Bracket the roots of P_N on a fixed grid, then bisect all brackets at once
+        h = 0.01
+        a = np.arange(-1, 1, h)
+        b = a + h
+        Pa = legendre_basis(N, a)[0][N]
+        Pb = legendre_basis(N, b)[0][N]
+        bracket = (Pa * Pb < 0) | (Pa == 0)
+        a = a[bracket]
+        b = b[bracket]
+        eps = np.finfo(float).eps
+        iterator = 0
+        while np.any(np.abs(a - b) >= eps) and iterator <= 1000000:
+            c = (a + b) / 2
+            s = legendre_basis(N, a)[0][N] * legendre_basis(N, c)[0][N]
+            a = np.where(s > 0, c, a)
+            b = np.where(s < 0, c, b)
+            a = np.where(s == 0, c, a)
+            b = np.where(s == 0, c, b)
+            iterator += 1
+        x[:] = (a + b) / 2
+
+        dPN = legendre_basis(N, x)[1][N]
+        w[:] = (2 / ((1.0-(np.power(x, 2)))*np.power(dPN,2)))
+
+    x.setflags(write=False)
+    w.setflags(write=False)
+    GAUSS_TABLES[N] = (x, w)
+    return x, w
+
+def spectral_estimate(values, LGn, LGw):
+    # Fits log|a_n| over the last modes of the nodal values on the Gauss nodes LGn - returns the
+    # slope and the estimated truncation error. A flat tail (slope ~ 0) is bounded by the
+    # machine epsilon rather than divided by, so an all-zero spectrum estimates 0, not 0/0.
+    N = len(LGn)
+    an = np.abs(np.dot(modal_table(LGn, LGw), np.asarray(values, dtype='float64')))
+    nl = np.arange(N)
+    an = np.maximum(an, np.finfo(float).tiny)
+
+    LG = LinearRegression()
+    coeffs = LG.estimate_coef(nl[-5:], np.log(an[-5:]))
+
+    C = np.exp(coeffs[0])
+    sigma = max(np.abs(coeffs[1]), np.finfo(float).eps)
+    error = (np.sqrt((C ** 2) / (2 * sigma)) * np.exp(-sigma * (N + 1)))
+    return coeffs[1], error
+
+# Lagrange basis values/derivatives at -1 and 1 for each order
+#           TRACE_TABLES[KEY = N] -> [l(-1), l(1), l'(-1), l'(1)] #
+TRACE_TABLES = {}
+
+BOUNDARY_KINDS = ["periodic", "dirichlet", "neumann", "outflow"]
+ADVECTIVE_FLUXES = ["upwind", "central"]
+DIFFUSIVE_FLUXES = ["ldg", "central", "ip"]
+
+# Quadrature and operator tables only depend on Nmax, so they are built once per process
+#           OPERATOR_TABLES[KEY = Nmax] -> [Nodes_and_Weights, bcw, Dhat] #
+OPERATOR_TABLES = {}
+
+def index_positions(n, members):
+    # pos[members[i]] = i and -1 for everything else
+    pos = np.full(n, -1)
+    pos[members] = np.arange(len(members))
+    return pos
 
 class NodalDiscontinuousGalerkin():
-    def __init__(self, N, K, xk):
+    def __init__(self, N, K, xk, orders=None, initial_condition=None, verbose=True, dtype='float64'):
         # Initialising Global Variables
+        # xk - breakpoints array or list of [a, b] pairs, stored as a (K, 2) array
+        # orders - optional per-element N (e.g. from initial_mesh), otherwise N everywhere
+        # initial_condition - optional callable u0(x), otherwise exp(-x^2). It may return a
+        #                     (size, M) array to run an ensemble of M members on one mesh
+        # dtype - storage precision of the state and the Dhat/trace operators. The RK register,
+        #         norms and spectral indicator are always evaluated in float64.
+        self.mesh = Mesh()
+        xk = self.mesh.elements(xk)
+        if K != len(xk):
+            raise ValueError("K = {} but the mesh has {} elements".format(K, len(xk)))
         self.xk = xk
         self.xk_orig = xk
         self.K = K
+        # Advection speed c(x), diffusivity nu(x) and source s(x, t) - see set_coefficients
         self.c = 1.0
+        self.nu = 1.0
+        self.source = None
         self.split_elems = []
         self.j = 0
 
+        # Periodic mesh, upwind advection and LDG diffusion unless set_boundary/set_fluxes say otherwise
+        self.bc = ["periodic", "periodic"]
+        self.bc_values = [0.0, 0.0]
+        self.advective_flux = "upwind"
+        self.diffusive_flux = "ldg"
+        self.penalty = 1.0
+
 
         ### ----------- Changing N ----------- ###
         # (Vary with N)
-        #            N_dict[KEY = xk[k] -> N
+        #            Ns[k] -> N of element k, offsets[k] -> its first node in xi/xij
         self.N = N
+        self.orders = orders
+        self.initial_condition = initial_condition
         self.Nmax = 25
         self.size = 0
-
-        # Initialise N_dict
-        self.N_dict = {}
-        self.initialise_N()
-
-        # Element sizes
-        self.xk = xk
-        self.delta_x = np.ones(K)
-        for k in range(0, K):
-            self.delta_x[k] = xk[k][1]-xk[k][0]
-            ## END
-        print("Delta_x:", self.delta_x)
-        print("x:", self.xk)
-        print("\n\n")
-
-        # Jacobian and Inverse
-        self.J = self.delta_x/2
-        self.Ji = 1/self.J
-
-
-        # Initialise Nodes_and_Weights_dict
-        #           Nodes_and_Weights[KEY = N] -> [LIST OF NODES[0] & WEIGHTS[1]] #
-        self.Nodes_and_Weights_dict = {}
-        self.bcw_dict = {}
-        self.initialise_NaW()
-
-        # Initialise the Dhat
-        self.Dhat_dict = {}
-        self.Ghat_dict = {}
-        self.initialise_Dhat()
-        self.initialise_Ghat()
+        self.dtype = np.dtype(dtype)
+
+        if self.Nmax not in OPERATOR_TABLES:
+            # Initialise Nodes_and_Weights_dict
+            #           Nodes_and_Weights[KEY = N] -> [LIST OF NODES[0] & WEIGHTS[1]] #
+            self.Nodes_and_Weights_dict = {}
+            self.bcw_dict = {}
+            self.initialise_NaW()
+
+            # Initialise the Dhat
+            self.Dhat_dict = {}
+            self.initialise_Dhat()
+            OPERATOR_TABLES[self.Nmax] = [self.Nodes_and_Weights_dict, self.bcw_dict, self.Dhat_dict]
         # print("ENDING NEW INITIALISE PROCESS")
+        [self.Nodes_and_Weights_dict, self.bcw_dict, self.Dhat_dict] = OPERATOR_TABLES[self.Nmax]
         ### ----------- Changing N ----------- ###
 
-        [self.LGx, self.LGw] = self.LegendreGaussNodesAndWeights(N)
+        if N in self.Nodes_and_Weights_dict:
+            [self.LGx, self.LGw] = self.Nodes_and_Weights_dict[N]
+        else:
+            [self.LGx, self.LGw] = self.LegendreGaussNodesAndWeights(N)
         self.wb = self.barycentricWeights(self.LGx)
 
         # Initialising elements and their lengths
         # Initialise the Jacobian for each element
         self.elementInit(K, xk)
+        if verbose:
+            print("Delta_x:", self.delta_x)
+            print("x:", self.xk)
+            print("\n\n")
 
         # Initial Conditions
         self.initial_conditions()
 
-        # Initialise interpolated values
-        self.fluxInit(K)
+        # Neighbour arrays and order groups for the flux evaluation
+        self.connectivity()
         return
 
     # Initialisation
-    def initialise_N(self, el_list = None):
-        if el_list != None:
-            self.N_dict[el_list[0]] = self.N_dict[self.xk[el_list[1]][0]]
+    def initialise_N(self, el=None):
+        # el - element that was just split, both halves keep its order
+        if el is not None:
+            self.Ns = np.insert(self.Ns, el + 1, self.Ns[el])
+        elif self.orders is not None:
+            self.Ns = np.array(self.orders, dtype='int')
         else:
-            for i in self.xk:
-                self.N_dict[i[0]] = self.N
+            self.Ns = np.full(len(self.xk), self.N, dtype='int')
+        self.element_layout()
         return
+    def element_layout(self):
+        # First node of every element and the total number of nodes, from the orders
+        self.offsets = np.concatenate(([0], np.cumsum(self.Ns)[:-1])).astype('int')
+        self.size = int(np.sum(self.Ns))
     def initialise_NaW(self):
         for n in range(3, self.Nmax):
             nodes, weights = self.LegendreGaussNodesAndWeights(n)
@@ -96,66 +239,36 @@ class NodalDiscontinuousGalerkin():
                     Dhij[i,j] = -Dij[j,i] * (LGw[j]/LGw[i])
             self.Dhat_dict[n] = Dhij
 
-    def initialise_Ghat(self):
-        for n in range(3, self.Nmax):
-
-            nodesandweights = self.Nodes_and_Weights_dict[n]
-            LGx = nodesandweights[0]
-            LGw = nodesandweights[1]
-            Dij = self.polynomialDerivativeMatrix(LGx)
-            Ghij = np.zeros_like(Dij, dtype='float')
-            for j in range(0, n):
-                for m in range(0, n):
-                    s = 0
-                    for k in range(0, n):
-                        s = s - (1 / LGw[j]) * Dij[k, m] * Dij[k, j] * LGw[k]
-                    Ghij[j, m] = (s)
-            # print("N = {}".format(n))
-            # print(Ghij)
-            self.Ghat_dict[n] = Ghij
-
-    def elementInit(self, K, xk, el_key=None):
+    def elementInit(self, K, xk, el=None):
         # Initialising elements and their lengths
-        self.xk = xk
-        self.delta_x = np.ones(K)
-        for k in range(0, K):
-            self.delta_x[k] = xk[k][1] - xk[k][0]
+        self.xk = self.mesh.elements(xk)
         # Initialise the Jacobian for each element
-        self.J = self.delta_x / 2
-        self.Ji = 1 / self.J
+        self.delta_x, self.J, self.Ji = self.mesh.geometry(self.xk)
 
-        # Initialises new N_dict before soln split
-        self.initialise_N(el_key)
+        # Initialises the new orders before soln split
+        self.initialise_N(el)
         return
     def initial_conditions(self):
-        for k in range(self.K):
-            self.size += self.N_dict[self.xk[k][0]]
-
-        self.xij = np.zeros((self.size), dtype='float')
-        self.xi = np.zeros((self.size), dtype='float')
-        m = 0
         sigma = 0.2
-        for k in range(self.K):
-            N = self.N_dict[self.xk[k][0]]
-            LGx = self.Nodes_and_Weights_dict[N][0]
-            for j in range(N):
-                self.xi[j + m] = self.xk[k][0] + ((LGx[j] + 1.0) / 2.0) * self.delta_x[k]
-                # self.xij[j + m] = np.exp(-np.log(2) * np.power((self.xi[j + m] + 0.5), 2) / sigma ** 2)
-                self.xij[j + m] = np.exp(-np.power(self.xi[j + m], 2.0) / 1.0)
-                # self.xij[j + m] = -np.power(self.xi[j + m],2) + 64
-
-            m += N
+        xi = self.node_coordinates()
+        if self.initial_condition is not None:
+            xij = np.asarray(self.initial_condition(xi), dtype='float')
+        else:
+            # xij = np.exp(-np.log(2) * np.power((xi + 0.5), 2) / sigma ** 2)
+            xij = np.exp(-np.power(xi, 2.0) / 1.0)
+        # xij = -np.power(xi,2) + 64
+        self.xi = xi.astype(self.dtype)
+        self.xij = xij.astype(self.dtype)
         self.init_cond = self.xij
-    def fluxInit(self, ks):
-        self.Fluxes = np.empty(shape=(ks), dtype='object')
-        self.DFluxes = np.empty(shape=(ks), dtype='object')
-        ind = 0
-        for k in range(0, ks):
-            N = self.N_dict[self.xk[k][0]]
-            self.Fluxes[k] = self.fluxes(self.xij[ind:ind + N], k)
-            self.DFluxes[k] = self.derivativefluxes(self.xij[ind:ind + N], k)
-            ind += N
-        return
+    def node_coordinates(self):
+        # Quadrature nodes of every element, one vectorised pass per polynomial order
+        xi = np.zeros(self.size, dtype='float')
+        for N in np.unique(self.Ns):
+            ks = np.where(self.Ns == N)[0]
+            LGx = self.Nodes_and_Weights_dict[N][0]
+            idx = self.offsets[ks][:, None] + np.arange(N)
+            xi[idx] = self.xk[ks, 0][:, None] + ((LGx + 1.0) / 2.0) * self.delta_x[ks][:, None]
+        return xi
 
     # h-refinement
     def element_split(self, el):
@@ -174,216 +287,438 @@ class NodalDiscontinuousGalerkin():
                 xk_new.append(np.array([a_mid,a2]))
             else:
                 xk_new.append(self.xk[k])
-        self.elementInit(self.K+1, xk_new, [a_mid, el])
+        self.elementInit(self.K+1, xk_new, el)
         self.solution_split(el)
     def solution_split(self, el):
-        # Finding xis and xijs to be interpolated
-        N = self.N_dict[self.xk[el][0]]
-        K = self.K
-        interp_val = np.zeros(N)
-        xis_old_interp = np.zeros(N)
-
-        # Get the first index of the 'split' element
-        ind = 0
-        for k in range(el):
-            ind += self.N_dict[self.xk[k][0]]
-
-        N = self.N_dict[self.xk[el][0]]
-        ctr = 0
-        for i in range(ind, ind+N):
-            xis_old_interp[ctr] = self.xi_old[i]
-            interp_val[ctr] = self.xij[i]
-            ctr += 1
+        # Interpolates the split element's solution onto the nodes of its two halves
+        N = self.Ns[el]
+        ind = self.offsets[el]
+        xis_old_interp = np.asarray(self.xi_old[ind:ind + N], dtype='float')
+        interp_val = np.asarray(self.xij[ind:ind + N], dtype='float')
 
         # Recaluclating xi
-
-        m = 0
-        sigma = 0.2
-
-        self.size = 0
-        for k in range(K+1):
-            self.size += self.N_dict[self.xk[k][0]]
-        self.xi = np.zeros(self.size, dtype='float')
-        for k in range(K+1):
-            N = self.N_dict[self.xk[k][0]]
-            LGx = self.Nodes_and_Weights_dict[N][0]
-            for j in range(N):
-                self.xi[j + m] = self.xk[k][0] + ((LGx[j] + 1.0) / 2.0) * self.delta_x[k]
-            m += N
-
-        N = self.N_dict[self.xk[el][0]]
-        xis_new_interp = np.zeros(2*N)
-        ctr = 0
-
-        for i in range(ind, ind+2*N):
-            xis_new_interp[ctr] = self.xi[i]
-            ctr += 1
+        self.xi = self.node_coordinates().astype(self.dtype)
+        xis_new_interp = np.asarray(self.xi[ind:ind + 2 * N], dtype='float')
 
         T = self.polynomialInterpolationMatrix(xis_old_interp, self.bcw_dict[N][0], xis_new_interp)
         f = self.interpolateToNewPoints(T, interp_val)
 
-        # Assembling new xij
-        xij_new = np.zeros_like(self.xi, dtype='float')
-        for i in range(len(xij_new)):
-            if i < ind:
-                xij_new[i] = self.xij[i]
-            elif  ind <= i <ind+2*N:
-                xij_new[i] = f[i-ind]
-            else:
-                xij_new[i] = self.xij[i-N]
+        # Assembling new xij - the N old nodes are replaced by the 2N new ones
         self.split_elems.append(self.xk[el][0])
         self.K += 1
-        self.xij = xij_new
-        self.fluxInit(self.K)
+        self.xij = np.concatenate((self.xij[:ind], f.astype(self.dtype), self.xij[ind + N:]))
+        self.reproject_fields(T, ind, N)
+        self.connectivity()
 
     # p-refinement
     def P_refinement(self, el):
-        # Finding xis and xijs to be interpolated
+        # Interpolates the element's solution onto the nodes of the next order
         self.xi_old = self.xi
-        N = self.N_dict[self.xk[el][0]]
-        K = self.K
-        interp_val = np.zeros(N)
-        xis_old_interp = np.zeros(N)
-
-        # Get the first index of the 'split' element
-        ind = 0
-        for k in range(el):
-            ind += self.N_dict[self.xk[k][0]]
-
-        N = self.N_dict[self.xk[el][0]]
-        ctr = 0
-        for i in range(ind, ind+N):
-            xis_old_interp[ctr] = self.xi_old[i]
-            interp_val[ctr] = self.xij[i]
-            ctr += 1
+        N = self.Ns[el]
+        ind = self.offsets[el]
+        xis_old_interp = np.asarray(self.xi_old[ind:ind + N], dtype='float')
+        interp_val = np.asarray(self.xij[ind:ind + N], dtype='float')
 
         # Recaluclating xi
+        self.Ns[el] += 1
+        self.element_layout()
+        self.xi = self.node_coordinates().astype(self.dtype)
+        xis_new_interp = np.asarray(self.xi[ind:ind + N + 1], dtype='float')
 
-        m = 0
-        sigma = 0.2
-        self.size = 0
-        for k in range(K):
-            self.size += self.N_dict[self.xk[k][0]]
-        self.size += 1
-        self.xi = np.zeros(self.size, dtype='float')
-        self.N_dict[self.xk[el][0]] += 1
-
-        for k in range(self.K):
-            N = self.N_dict[self.xk[k][0]]
-            LGx = self.Nodes_and_Weights_dict[N][0]
-            for j in range(N):
-                self.xi[j + m] = self.xk[k][0] + ((LGx[j] + 1.0) / 2.0) * self.delta_x[k]
-            m += N
-
-        N = self.N_dict[self.xk[el][0]]
-        xis_new_interp = np.zeros(N)
-        ctr = 0
-        for i in range(ind, ind+N):
-            xis_new_interp[ctr] = self.xi[i]
-            ctr += 1
+        # Interpolate from the old order N nodes, so their barycentric weights are needed
         T = self.polynomialInterpolationMatrix(xis_old_interp, self.bcw_dict[N][0], xis_new_interp)
         f = self.interpolateToNewPoints(T, interp_val)
 
-        # Assembling new xij
-        xij_new = np.zeros_like(self.xi, dtype='float')
-
-        N = self.N_dict[self.xk[el][0]]
-
-        for i in range(len(xij_new)):
-            if i < ind:
-                xij_new[i] = self.xij[i]
-            elif  ind <= i <ind+N:
-                xij_new[i] = f[i-ind]
+        # Assembling new xij - the N old nodes are replaced by the N + 1 new ones
+        self.xij = np.concatenate((self.xij[:ind], f.astype(self.dtype), self.xij[ind + N:]))
+        self.reproject_fields(T, ind, N)
+        self.connectivity()
+
+    # Boundary conditions and numerical fluxes
+    def set_boundary(self, left="periodic", right="periodic", left_value=0.0, right_value=0.0):
+        # Kinds - "periodic" (on both sides), "dirichlet" (u = value), "neumann" (u_x = value)
+        # and "outflow" (interior u for the advective flux, no diffusive flux - a homogeneous
+        # Neumann condition, the diffusion operator needs one). Values are constants or callables of t.
+        for kind in [left, right]:
+            if kind not in BOUNDARY_KINDS:
+                raise ValueError("Unknown boundary condition: {}".format(kind))
+        if (left == "periodic") != (right == "periodic"):
+            raise ValueError("Periodic boundaries must be set on both sides")
+        self.bc = [left, right]
+        self.bc_values = [left_value, right_value]
+        self.connectivity()
+
+    def set_fluxes(self, advective="upwind", diffusive="ldg", penalty=1.0):
+        # advective - "upwind" (by the sign of c) or "central"
+        # diffusive - "ldg" (u from the right, q from the left), "central" or "ip" (interior
+        #             penalty, q* = {u_x} - tau [u] with tau = penalty * N^2 / h)
+        if advective not in ADVECTIVE_FLUXES:
+            raise ValueError("Unknown advective flux: {}".format(advective))
+        if diffusive not in DIFFUSIVE_FLUXES:
+            raise ValueError("Unknown diffusive flux: {}".format(diffusive))
+        self.advective_flux = advective
+        self.diffusive_flux = diffusive
+        self.penalty = penalty
+        self.connectivity()
+
+    # Coefficients and sources
+    def set_coefficients(self, c=None, nu=None, source=None):
+        # c, nu - constants, callables of x (called once with all the nodes) or arrays on xi
+        # source - None, a constant or a callable s(x, t), evaluated once per stage on all the nodes
+        # Everything is checked before anything is assigned, so a rejected call leaves the solver as it was
+        specs = {}
+        for name, spec in [("c", c), ("nu", nu)]:
+            if spec is None:
+                continue
+            if callable(spec):
+                shape = np.shape(spec(self.x_nodes))
+                valid = shape in [(), (1,), (self.size,)]
+            elif not np.isscalar(spec):
+                spec = np.asarray(spec, dtype='float')
+                shape = spec.shape
+                valid = shape == (self.size,)
             else:
-                xij_new[i] = self.xij[i-1]
-
-        self.xij = xij_new
-        self.fluxInit(self.K)
-
-
-
-    # Calculations
-    def DGTimeDerivative(self, t, k, xij):
-        self.Fluxes[k] = self.fluxes(xij, k)
-        self.DFluxes[k] = self.derivativefluxes(xij, k)
-
-        # U moving left-to-right
-        # Q moving left-to-right
-        if k == 0 and self.c > 0:
-            un = self.Fluxes[k][0]
-            up = self.Fluxes[k+1][0]
-            qn = self.DFluxes[-1][1]
-            # qn = 0
-            qp = self.DFluxes[k][1]
-            # print("For k={} - Fluxes: un={}, up={}, qn={}, qp={}".format(k, un, up, qn, qp))
-            xijtd = self.c * self.DGDerivative(un, up, xij, k, qn, qp)
-
-        elif k == self.K-1:
-            un = self.Fluxes[k][0]
-            up = self.Fluxes[0][0]
-            # up = 0
-            qn = self.DFluxes[k-1][1]
-            qp = self.DFluxes[k][1]
-            # print("For k={} - Fluxes: un={}, up={}, qn={}, qp={}".format(k, un, up, qn, qp))
-            xijtd = self.c * self.DGDerivative(un, up, xij, k, qn, qp)
-
+                valid = True
+            if not valid:
+                raise ValueError("{} has shape {}, the mesh has {} nodes".format(name, shape, self.size))
+            specs[name] = spec
+        for name, spec in specs.items():
+            setattr(self, name, spec)
+        if source is not None:
+            self.source = source
+        self.connectivity()
+
+    def coefficient_fields(self):
+        # Per order group nodal blocks, per face values (average of the two traces) and per element
+        # maxima of c and nu. Callables are re-evaluated at the current nodes, nodal arrays are
+        # carried through refinement by reproject_fields.
+        self.x_nodes = self.xi if self.xi.dtype == np.float64 else self.node_coordinates()
+        self.coeff_blocks = [[None, None] for _ in self.groups]
+        for num, name in enumerate(["c", "nu"]):
+            spec = getattr(self, name)
+            if np.isscalar(spec):
+                for blocks in self.coeff_blocks:
+                    blocks[num] = float(spec)
+                setattr(self, name + "_face", float(spec))
+                setattr(self, name + "_element", np.full(self.K, abs(float(spec))))
+                continue
+            if callable(spec):
+                values = np.broadcast_to(np.asarray(spec(self.x_nodes), dtype='float'), self.x_nodes.shape)
+            else:
+                values = spec
+            if values.shape != (self.size,):
+                raise ValueError("{} has {} nodal values, the mesh has {} nodes".format(name, len(values), self.size))
+            vL = np.zeros(self.K)
+            vR = np.zeros(self.K)
+            vmax = np.zeros(self.K)
+            for blocks, (N, ks, idx) in zip(self.coeff_blocks, self.groups):
+                lL, lR, dL, dR = self.trace_operators(N)
+                blocks[num] = values[idx]
+                vL[ks] = values[idx] @ lL
+                vR[ks] = values[idx] @ lR
+                vmax[ks] = np.max(np.abs(values[idx]), axis=1)
+            vm, vp = self.face_values(vL, vR)
+            setattr(self, name + "_face", (vm + vp) / 2)
+            setattr(self, name + "_element", vmax)
+
+    def reproject_fields(self, T, ind, n):
+        # Nodal coefficient arrays follow the solution when the n nodes from ind are replaced using T
+        for name in ["c", "nu"]:
+            values = getattr(self, name)
+            if isinstance(values, np.ndarray):
+                f = self.interpolateToNewPoints(T, values[ind:ind + n])
+                setattr(self, name, np.concatenate((values[:ind], f, values[ind + n:])))
+
+    def source_values(self, t, nodes=slice(None)):
+        # Source at time t on all (or the selected) nodes in one vectorised call
+        if callable(self.source):
+            return np.asarray(self.source(self.x_nodes[nodes], t), dtype='float')
+        return np.asarray(self.source, dtype='float')
+
+    def connectivity(self):
+        # Neighbour index arrays and order groups - rebuilt whenever the mesh or orders change.
+        # Face i lies between elements face_left[i] and face_right[i] (-1 at a boundary), so
+        # element k has faces k and k+1.
+        K = self.K
+        self.face_left = np.arange(-1, K)
+        self.face_right = np.arange(0, K + 1)
+        self.face_right[K] = -1
+        if self.bc[0] == "periodic":
+            self.face_left[0] = K - 1
+            self.face_right[K] = 0
+
+        self.node_element = np.repeat(np.arange(K), self.Ns)
+        self.groups = []
+        for N in np.unique(self.Ns):
+            ks = np.where(self.Ns == N)[0]
+            idx = self.offsets[ks][:, None] + np.arange(N)
+            self.groups.append([N, ks, idx])
+
+        # Operators of each order group, used in float64 to assemble the stencils
+        #           group_operators[num] -> [Dhat, rows l(-1), l(1), l'(-1), l'(1), columns l(-1)/w, l(1)/w] #
+        self.group_operators = []
+        for N, ks, idx in self.groups:
+            lL, lR, dL, dR = self.trace_operators(N)
+            LGw = self.Nodes_and_Weights_dict[N][1]
+            self.group_operators.append([self.Dhat_dict[N], np.array([lL, lR, dL, dR]), (lL / LGw)[:, None], (lR / LGw)[:, None]])
+
+        # Interior penalty per face from the adjacent orders and sizes
+        left = np.where(self.face_left >= 0, self.face_left, self.face_right)
+        right = np.where(self.face_right >= 0, self.face_right, self.face_left)
+        self.face_tau = (self.penalty * np.power(np.maximum(self.Ns[left], self.Ns[right]), 2)
+                         / np.minimum(self.delta_x[left], self.delta_x[right]))
+        self.coefficient_fields()
+        # Stencils and evaluation plans are assembled on first use
+        self.stencil = None
+        self.plans = {}
+
+    def trace_operators(self, N):
+        # Lagrange basis and its derivative at -1 and 1 for the order N nodes
+        if N not in TRACE_TABLES:
+            LGx = self.Nodes_and_Weights_dict[N][0]
+            wb = self.bcw_dict[N][0]
+            lL = self.lagrangeInterpolatingPolynomials(-1, LGx, wb)
+            lR = self.lagrangeInterpolatingPolynomials(1, LGx, wb)
+            I = np.eye(N)
+            dL = np.array([self.lagrangeinterpolantderivative(-1, LGx, I[j], wb) for j in range(N)])
+            dR = np.array([self.lagrangeinterpolantderivative(1, LGx, I[j], wb) for j in range(N)])
+            TRACE_TABLES[N] = [lL, lR, dL, dR]
+        return TRACE_TABLES[N]
+
+    def boundary_value(self, side, t):
+        value = self.bc_values[side]
+        return value(t) if callable(value) else value
+
+    def face_values(self, vL, vR, ghost=None):
+        # Values on the left (minus) and right (plus) of every face. At non-periodic boundaries the
+        # outside value is the interior one unless ghost[side] gives it.
+        vm = vR[self.face_left]
+        vp = vL[self.face_right]
+        if self.bc[0] != "periodic":
+            vm[0] = vp[0] if ghost is None or ghost[0] is None else ghost[0]
+            vp[-1] = vm[-1] if ghost is None or ghost[1] is None else ghost[1]
+        return vm, vp
+
+    def element_neighbours(self, mask):
+        # Elements in mask plus their face neighbours
+        grown = mask.copy()
+        left = self.face_left[:-1][mask]
+        right = self.face_right[1:][mask]
+        grown[left[left >= 0]] = True
+        grown[right[right >= 0]] = True
+        return grown
+
+    def boundary_data(self, t):
+        # [u left, u right, u_x left, u_x right] imposed at time t - zero where nothing is imposed
+        g = np.zeros(4)
+        for side in [0, 1]:
+            if self.bc[side] == "dirichlet":
+                g[side] = self.boundary_value(side, t)
+            elif self.bc[side] == "neumann":
+                g[2 + side] = self.boundary_value(side, t)
+        return g
+
+    def weak_operator(self, X, ghost_u, ghost_q):
+        # du/dt = -(c u - nu q)_x with q = u_x, both in weak form, without the source, for states X
+        # of shape (size, M) on the whole mesh. ghost_u/ghost_q[side] are the outside u and q at a
+        # boundary (None for the interior trace). Returns du/dt and the total numerical flux F* on
+        # every face. Only used to assemble the stencils that time_derivative applies.
+        K = self.K
+        M = X.shape[1]
+        Ji = self.Ji[:, None]
+        block = lambda v: v[:, :, None] if isinstance(v, np.ndarray) else v
+        at_face = lambda v: v[:, None] if isinstance(v, np.ndarray) else v
+
+        # Traces of u and u_x
+        uL, uR, uxL, uxR = [np.empty((K, M)) for _ in range(4)]
+        for (N, ks, idx), (Dhat, traces, lLw, lRw) in zip(self.groups, self.group_operators):
+            tr = np.matmul(traces, X[idx])
+            uL[ks] = tr[:, 0]
+            uR[ks] = tr[:, 1]
+            uxL[ks] = Ji[ks] * tr[:, 2]
+            uxR[ks] = Ji[ks] * tr[:, 3]
+
+        um, up = self.face_values(uL, uR, ghost_u)
+        if self.diffusive_flux == "ldg":
+            ustar = up.copy()
         else:
-            un = self.Fluxes[k][0]
-            up = self.Fluxes[k+1][0]
-            qn = self.DFluxes[k-1][1]
-            qp = self.DFluxes[k][1]
-            # print("For k={} - Fluxes: un={}, up={}, qn={}, qp={}".format(k, un, up, qn, qp))
-            xijtd = self.c * self.DGDerivative(un, up, xij, k, qn, qp)
-        return xijtd
-
-    def DGDerivative(self, un, up, xij, k, qn, qp):
-        # Initialising Nodes/Weights
-        N = self.N_dict[self.xk[k][0]]
-        LGw = self.Nodes_and_Weights_dict[N][1]
-        Dhij = self.Dhat_dict[N]
-
-
-        q = np.matmul(Dhij, xij)
-        for j in range(0, len(xij)):
-            q[j] = - q[j] - ((up * self.lj1[j] - un * self.ljn1[j])/LGw[j])
-            q[j] = q[j] * self.Ji[k]
-
-        udot = np.matmul(Dhij, q)
-        ux =  np.matmul(Dhij, xij)
-        for j in range(0, len(xij)):
-            udot[j] = - udot[j] - ((qp * self.lj1[j] - qn * self.ljn1[j])/LGw[j]) - ux[j]
-            udot[j] = udot[j] * self.Ji[k]
-
-        return udot
-
-    def fluxes(self, xij, k):
-        N = self.N_dict[self.xk[k][0]]
-        LGx = self.Nodes_and_Weights_dict[N][0]
-        wb = self.bcw_dict[N][0]
-
-        self.ljn1 = self.lagrangeInterpolatingPolynomials(-1, LGx, wb)
-        self.lj1 = self.lagrangeInterpolatingPolynomials(1, LGx, wb)
-
-        xiL = self.InterpolateToBoundary(xij, self.ljn1)
-        xiR = self.InterpolateToBoundary(xij, self.lj1)
-
-        return np.array([xiL, xiR])
-
-    def derivativefluxes(self, xij, k):
-        N = self.N_dict[self.xk[k][0]]
-        LGx = self.Nodes_and_Weights_dict[N][0]
-        wb = self.bcw_dict[N][0]
-
-        xiL = self.lagrangeinterpolantderivative(-1, LGx, xij, wb)
-        xiR = self.lagrangeinterpolantderivative(1, LGx, xij, wb)
-
-        return np.array([xiL, xiR])
-
+            ustar = (um + up) / 2
+        if self.bc[0] != "periodic":
+            ustar[0] = um[0]
+            ustar[-1] = up[-1]
+
+        # Gradient q
+        qL = np.empty((K, M))
+        qR = np.empty((K, M))
+        Q = []
+        for (N, ks, idx), (Dhat, traces, lLw, lRw) in zip(self.groups, self.group_operators):
+            q = Ji[ks][:, :, None] * (np.matmul(Dhat, X[idx]) + ustar[ks + 1][:, None] * lRw - ustar[ks][:, None] * lLw)
+            tr = np.matmul(traces[:2], q)
+            qL[ks] = tr[:, 0]
+            qR[ks] = tr[:, 1]
+            Q.append(q)
+
+        # Numerical fluxes
+        c = at_face(self.c_face)
+        if self.advective_flux == "upwind":
+            uadv = np.where(c >= 0, um, up)
+        else:
+            uadv = (um + up) / 2
+        qm, qp = self.face_values(qL, qR, ghost_q)
+        if self.diffusive_flux == "ldg":
+            qstar = qm
+        elif self.diffusive_flux == "central":
+            qstar = (qm + qp) / 2
+        else:
+            uxm, uxp = self.face_values(uxL, uxR, ghost_q)
+            qstar = (uxm + uxp) / 2 - at_face(self.face_tau) * (um - up)
+        for side, face in [(0, 0), (1, -1)]:
+            if self.bc[side] in ["neumann", "outflow"]:
+                qstar[face] = ghost_q[side]
+        Fstar = c * uadv - at_face(self.nu_face) * qstar
+
+        # Element update
+        udot = np.empty((self.size, M))
+        for (N, ks, idx), (Dhat, traces, lLw, lRw), q, (cb, nub) in zip(self.groups, self.group_operators, Q, self.coeff_blocks):
+            F = block(cb) * X[idx] - block(nub) * q
+            udot[idx] = -Ji[ks][:, :, None] * (np.matmul(Dhat, F) + Fstar[ks + 1][:, None] * lRw - Fstar[ks][:, None] * lLw)
+        return udot, Fstar
+
+    def stencils(self):
+        # du/dt and F* are affine in u, so they are assembled once per mesh as dense blocks - each
+        # element's du/dt reads the nodes of the elements up to two away (the fluxes on its faces
+        # use q of its neighbours), each face's F* the two adjacent elements and one beyond each.
+        # The blocks are found by probing weak_operator with unit states on elements at least
+        # five apart, so no block sees two probed elements, plus the response to unit boundary
+        # values. Columns of missing (boundary or lower order) nodes point at node 0 with a zero
+        # coefficient. Blocks are kept in the storage precision.
+        if self.stencil is not None:
+            return self.stencil
+        K = self.K
+        W = int(np.max(self.Ns))
+        step = lambda ks, nb: np.where(ks >= 0, nb[np.maximum(ks, 0)], -1)
+        left = self.face_left[:-1]
+        right = self.face_right[1:]
+        k = np.arange(K)
+        l1, r1 = step(k, left), step(k, right)
+        sources = [np.stack([step(l1, left), l1, k, r1, step(r1, right)], axis=1),
+                   np.stack([step(self.face_left, left), self.face_left, self.face_right, step(self.face_right, right)], axis=1)]
+        # Small periodic meshes wrap onto themselves - each source is kept once
+        for src in sources:
+            for j in range(1, src.shape[1]):
+                src[np.any(src[:, :j] == src[:, j:j + 1], axis=1), j] = -1
+
+        # Colours at least five apart, also across a periodic wrap
+        colour = np.arange(K) % 5
+        r = K % 5 if self.bc[0] == "periodic" else 0
+        colour[K - r:] = 5 + np.arange(r)
+
+        local = np.arange(W)
+        def columns(src):
+            valid = (src[:, :, None] >= 0) & (local < self.Ns[np.maximum(src, 0)][:, :, None])
+            cols = np.where(valid, self.offsets[np.maximum(src, 0)][:, :, None] + local, 0)
+            return valid, cols.reshape(len(src), -1)
+        element_valid, element_cols = columns(sources[0])
+        face_valid, face_cols = columns(sources[1])
+        blocks = [np.zeros((len(ks), N, 5, W)) for N, ks, idx in self.groups]
+        face_blocks = np.zeros((K + 1, 4, W))
+
+        zero = np.zeros(W)
+        ghost_u = [zero if kind == "dirichlet" else None for kind in self.bc]
+        ghost_q = [zero if kind in ["neumann", "outflow"] else None for kind in self.bc]
+        node_local = np.arange(self.size) - self.offsets[self.node_element]
+        for j in range(np.max(colour) + 1):
+            X = np.zeros((self.size, W))
+            probed = np.where(colour[self.node_element] == j)[0]
+            X[probed, node_local[probed]] = 1.0
+            udot, Fstar = self.weak_operator(X, ghost_u, ghost_q)
+            for B, (N, ks, idx) in zip(blocks, self.groups):
+                mask = element_valid[ks] & (colour[np.maximum(sources[0][ks], 0)] == j)[:, :, None]
+                B[:] = np.where(mask[:, None], udot[idx][:, :, None, :], B)
+            mask = face_valid & (colour[np.maximum(sources[1], 0)] == j)[:, :, None]
+            face_blocks[:] = np.where(mask, Fstar[:, None, :], face_blocks)
+
+        # Response to unit boundary values [u left, u right, u_x left, u_x right], kept on the
+        # nodes and faces it reaches
+        boundary = None
+        if self.bc[0] != "periodic":
+            unit = np.eye(4)
+            ghost_u = [unit[side] if self.bc[side] == "dirichlet" else None for side in [0, 1]]
+            ghost_q = [unit[2 + side] if self.bc[side] == "neumann" else (np.zeros(4) if self.bc[side] == "outflow" else None)
+                       for side in [0, 1]]
+            udot, Fstar = self.weak_operator(np.zeros((self.size, 4)), ghost_u, ghost_q)
+            nodes = np.where(np.any(udot != 0, axis=1))[0]
+            faces = np.where(np.any(Fstar != 0, axis=1))[0]
+            boundary = [nodes, udot[nodes].astype(self.dtype), faces, Fstar[faces].astype(self.dtype)]
+
+        #           stencil -> {"blocks": per group (n, N, 5W), "columns": per group (n, 5W), "face_blocks": (K+1, 1, 4W),
+        #                       "face_columns": (K+1, 4W), "boundary": [nodes, response, faces, response] or None} #
+        self.stencil = {"blocks": [B.reshape(len(B), B.shape[1], -1).astype(self.dtype) for B in blocks],
+                        "columns": [element_cols[ks] for N, ks, idx in self.groups],
+                        "face_blocks": face_blocks.reshape(K + 1, 1, -1).astype(self.dtype),
+                        "face_columns": face_cols, "boundary": boundary}
+        return self.stencil
+
+    def evaluation_plan(self, active=None):
+        # The stencil rows of the `active` elements (all when None) and of their faces, and the
+        # elements E2 whose values they read. Evaluating a plan costs O(|active|) and not O(K).
+        # Cached per mask until the mesh, orders, boundaries or coefficients change.
+        key = None if active is None else np.asarray(active).tobytes()
+        if key in self.plans:
+            return self.plans[key]
+        stencil = self.stencils()
+        K = self.K
+        if active is None:
+            active = np.ones(K, dtype='bool')
+        nodes = np.where(active[self.node_element])[0]
+        A = np.where(active)[0]
+        faces = np.union1d(A, A + 1)
+        full = len(A) == K
+        posN = index_positions(self.size, nodes)
+        posF = index_positions(K + 1, faces)
+        pick = lambda v, sel: v if full else v[sel]
+
+        plan = {"elements": np.where(self.element_neighbours(self.element_neighbours(active)))[0],
+                "nodes": nodes, "faces": faces, "groups": [],
+                "face_blocks": pick(stencil["face_blocks"], faces), "face_columns": pick(stencil["face_columns"], faces),
+                "boundary": None}
+        for (N, ks, idx), B, cols in zip(self.groups, stencil["blocks"], stencil["columns"]):
+            sel = np.where(active[ks])[0]
+            if len(sel) != 0:
+                plan["groups"].append([pick(B, sel), pick(cols, sel), posN[idx[sel]]])
+        if stencil["boundary"] is not None:
+            bnodes, bresponse, bfaces, fresponse = stencil["boundary"]
+            inN = posN[bnodes] >= 0
+            inF = posF[bfaces] >= 0
+            plan["boundary"] = [posN[bnodes[inN]], bresponse[inN], posF[bfaces[inF]], fresponse[inF]]
+        self.plans[key] = plan
+        return plan
+
+    def time_derivative(self, t, xij, plan=None):
+        # du/dt = -(c u - nu q)_x + s with q = u_x, both in weak form, on the active elements of an
+        # evaluation_plan (all elements by default), by applying the assembled stencils. Returns
+        # du/dt on plan["nodes"] and the total numerical flux F* on plan["faces"] - every node and
+        # face for the default plan.
+        if plan is None:
+            plan = self.evaluation_plan()
+        extra = xij.shape[1:]
+        # Ensemble dimensions are flattened to one trailing axis
+        X = xij.reshape(len(xij), -1)
+        udot = np.empty((len(plan["nodes"]), X.shape[1]), dtype=xij.dtype)
+        for blocks, columns, out in plan["groups"]:
+            udot[out] = np.matmul(blocks, X[columns])
+        Fstar = np.matmul(plan["face_blocks"], X[plan["face_columns"]])[:, 0]
+
+        if plan["boundary"] is not None:
+            g = self.boundary_data(t)
+            nodes, response, faces, face_response = plan["boundary"]
+            udot[nodes] += (response @ g.astype(self.dtype))[:, None]
+            Fstar[faces] += (face_response @ g.astype(self.dtype))[:, None]
+        if self.source is not None:
+            S = self.source_values(t, plan["nodes"])
+            udot += S.reshape(len(S), -1) if S.ndim != 0 else S
+        return udot.reshape((-1,) + extra), Fstar.reshape((-1,) + extra)
 
-    def g(self, t):
-        ans = np.exp(-np.power(-8.0,2)/(4.0*t+1.0))/(np.sqrt(4.0*t+1.0))
-        return ans
-    
     def polynomialDerivativeMatrix(self, xj):
         wj = self.barycentricWeights(xj)
         D = np.zeros((len(xj), len(xj)))
@@ -501,13 +836,8 @@ class NodalDiscontinuousGalerkin():
 
 
     def interpolateToNewPoints(self, Tij, fj):
-        fInterp = np.ones(Tij.shape[0])
-        for i in range(0, Tij.shape[0]):
-            t = 0
-            for j in range(0, Tij.shape[1]):
-                t = t + Tij[i, j] * fj[j]
-            fInterp[i] = t
-        return fInterp
+        # Also interpolates every member of an ensemble (fj of shape (n, M)) at once
+        return np.dot(Tij, np.asarray(fj, dtype='float'))
     def AlmostEqual(self, a, b):
         eps = np.finfo(float).eps
         if (a == 0 or b == 0):
@@ -522,89 +852,12 @@ class NodalDiscontinuousGalerkin():
                 return False
 
 
-    # Legendre Polynomials
-    def legendre_function(self, N, x):
-        if (N == 0):
-            LN = 1
-            LdashN = 0
-        elif (N == 1):
-            LN = x
-            LdashN = 1
-        elif N == 2:
-            LN2 = 1
-            LN1 = x
-            LdashN2 = 0
-            LdashN1 = 1
-            LN = (((2 * N - 1) / N) * x * LN1) - (((N - 1) / N) * LN2)
-            LdashN = LdashN2 + (((2 * N) - 1) * LN1)
-        else:
-            LN2 = 1
-            LN1 = x
-            LdashN2 = 0
-            LdashN1 = 1
-
-            for k in range(2, N):
-                LN = (((2 * k - 1) / k) * x * LN1) - (((k - 1) / k) * LN2)
-                LdashN = LdashN2 + (((2 * k) - 1) * LN1)
-
-                LN2 = LN1
-                LN1 = LN
-
-                LdashN2 = LdashN1
-                LdashN1 = LdashN
-
-        result = [LN, LdashN]
-
-        return result
     def LegendreGaussNodesAndWeights(self, N):
-        x = np.zeros(N, dtype='float')
-        w = np.zeros(N, dtype='float')
-
-        if (N == 0):
-            x[0] = 0.0
-            w[0] = 2.0
-        elif (N == 1):
-            x[0] = -np.sqrt(1.0/3.0)
-            w[0] = 1.0
-            x[1] = -x[0]
-            w[1] = w[0]
-        else:
-
-            h = 0.01
-            i = 0
-
-            for j in np.arange(-1, 1, h):
-                root = self.bisection(N+1, self.legendre_function, j, j + h)
-                if (root != 999):
-                    x[i] = root
-                    i += 1
-
-            for i in range(0, N):
-                Result = self.legendre_function((N+1), x[i])
-                w[i] = (2 / ((1.0-(pow(x[i], 2)))*pow(Result[1],2)))
-
-        return x, w
-    def bisection(self, N, func, a, b, eps=np.finfo(float).eps, max_iter=1000000):
-        if ((func(N, a)[0] * func(N, b)[0]) <= 0):
-            iterator = 0
-            while (abs(a - b) >= eps and iterator <= max_iter):
-
-                c = (a + b) / 2
-
-                if ((func(N, a)[0] * func(N, c)[0]) > 0):
-                    a = c
-                elif ((func(N, a)[0] * func(N, c)[0]) < 0):
-                    b = c
-                elif ((func(N, c)[0] == 0)):
-                    return c
-
-                iterator += 1
-            return c
-        else:
-            return 999
-
+        return legendre_gauss(N)
 
     def plot(self, t, T="N/A", errors=False):
+        # matplotlib is only loaded once something is drawn
+        from matplotlib import pyplot as plt
         points = 5
         height = 1.2
         self.j += 0.12
@@ -613,7 +866,7 @@ class NodalDiscontinuousGalerkin():
             y = np.arange(0, height, (height / points))
             plt.plot(x, y, linestyle='dashed', color='k')
 
-            if num == len(mesh) - 1:
+            if num == self.K - 1:
                 x = np.ones(points) * val[1]
                 y = np.arange(0, height, (height / points))
                 plt.plot(x, y, linestyle='dashed', color='k')
@@ -636,63 +889,75 @@ class NodalDiscontinuousGalerkin():
 
 
     def coefficients(self, n, k):
-        total = 0
-        N = self.N_dict[self.xk[k][0]]
-        ind = 0
-        for i in range(k):
-            ind += self.N_dict[self.xk[i][0]]
+        N = self.Ns[k]
+        ind = self.offsets[k]
 
         LGn, LGw = self.Nodes_and_Weights_dict[N]
-        for i in range(N):
-            x = LGn[i]
-            LN = self.legendre_function(n, x)[0]
-            total += self.xij[ind + i] * LN * LGw[i]
-        an = total * ((2 * n + 1) / 2)
+        an = np.dot(modal_table(LGn, LGw)[n], self.xij[ind:ind + N].astype('float64'))
         return an
+    def spectral_estimate(self, values, N):
+        # spectral_estimate on the order N Gauss nodes
+        LGn, LGw = self.Nodes_and_Weights_dict[N]
+        return spectral_estimate(values, LGn, LGw)
     def error_indicator(self, plot=False, printing=False, tol = 1.0):
         self.k_list = []
         self.sigmas = []
         self.errors = []
         for k in range(self.K):
             self.k_list.append(k)
-            an = []
-            nl = []
-            N = self.N_dict[self.xk[k][0]]
-            for n in range(N):
-                an.append(abs(self.coefficients(n, k)))
-                nl.append(n)
-            an = np.array(an)
-            nl = np.array(nl)
-
-            LG = LinearRegression()
-            coeffs = LG.estimate_coef(nl[-5:], np.log(an[-5:]))
-
-            self.sigmas.append(coeffs[1])
-
-            C = np.exp(coeffs[0])
-            sigma = np.abs(coeffs[1])
-            error = (np.sqrt((C ** 2) / (2 * sigma)) * np.exp(-sigma * (N + 1)))
+            N = self.Ns[k]
+            slope, error = self.spectral_estimate(self.xij[self.offsets[k]:self.offsets[k] + N], N)
+
+            self.sigmas.append(slope)
             if printing:
-                print("k: {}   Sigma: {}  error: {}  threshold: {}" .format(k, sigma, error, tol * self.L2norm_solution(k)))
+                print("k: {}   Sigma: {}  error: {}  threshold: {}" .format(k, np.abs(slope), error, tol * self.L2norm_solution(k)))
             self.errors.append(error)
 
         return
     def L2norm_solution(self, k):
         L2Norm = 0.0
         total = 0.0
-        N = self.N_dict[self.xk[k][0]]
+        N = self.Ns[k]
         LGw = self.Nodes_and_Weights_dict[N][1]
-        ind = 0
-        for i in range(k):
-            ind += self.N_dict[self.xk[i][0]]
+        ind = self.offsets[k]
 
         for n in range(N):
-            total += np.power(self.xij[ind + n],2) * LGw[n]
+            total += np.power(np.float64(self.xij[ind + n]),2) * LGw[n]
         L2Norm += np.power(total,0.5)
         return L2Norm
 
 
-def splitting(t, T, htol, ptol, dg, printing=False, hL2_lim=0, pL2_lim=0, Kmax=40):
+    # Local time stepping
+    def element_time_steps(self):
+        # Stable step estimate per element - advective (dx/(|c| N^2)) and diffusive (dx^2/(nu N^4)) limits
+        # from the largest c and nu on the element. The interior penalty adds a jump term of size
+        # nu tau ~ nu penalty N^2/dx, so the diffusive limit shrinks by 1 + penalty.
+        dt_k = np.full(self.K, np.inf)
+        N = self.Ns.astype('float')
+        scale = 1.0 + self.penalty if self.diffusive_flux == "ip" else 1.0
+        diff = self.nu_element > 0
+        dt_k[diff] = np.power(self.delta_x[diff], 2) / (scale * self.nu_element[diff] * N[diff] ** 4)
+        adv = self.c_element > 0
+        dt_k[adv] = np.minimum(dt_k[adv], self.delta_x[adv] / (self.c_element[adv] * N[adv] ** 2))
+        return dt_k
+    def time_step_levels(self, max_level=4):
+        # Level l elements step with dt_min * 2^l
+        dt_k = self.element_time_steps()
+        levels = np.floor(np.log2(dt_k / np.min(dt_k)) + 1e-12).astype('int')
+        levels = np.clip(levels, 0, max_level)
+        # The interface fluxes scale with the finer neighbour, so neighbours differ by at most one level
+        left = self.face_left[:-1]
+        right = self.face_right[1:]
+        while True:
+            bound = levels.copy()
+            bound[left >= 0] = np.minimum(bound[left >= 0], levels[left[left >= 0]] + 1)
+            bound[right >= 0] = np.minimum(bound[right >= 0], levels[right[right >= 0]] + 1)
+            if np.array_equal(bound, levels):
+                return levels
+            levels = bound
+
+
+def splitting(t, T, htol, ptol, dg, printing=False, hL2_lim=0, pL2_lim=0, Kmax=40, plot=True):
     if printing:
         dg.error_indicator(printing=True, tol=htol)
     else:
@@ -702,15 +967,16 @@ def splitting(t, T, htol, ptol, dg, printing=False, hL2_lim=0, pL2_lim=0, Kmax=4
     for k in range(dg.K):
         L2 = dg.L2norm_solution(k)
         # print("k={} - Error {} | {} Threshold | Sigma {}".format(k, dg.errors[k], tol2 * L2, np.abs(dg.sigmas[k])))
-        if dg.errors[k] >= ptol * L2 and np.abs(dg.sigmas[k]) > 1.0 and dg.N_dict[dg.xk[k][0]] <= DG.Nmax and L2 > pL2_lim :
+        if dg.errors[k] >= ptol * L2 and np.abs(dg.sigmas[k]) > 1.0 and dg.Ns[k] <= dg.Nmax and L2 > pL2_lim :
             print("P-REFINEMENT: {}".format(k))
-            dg.plot(t, T)
+            if plot:
+                dg.plot(t, T)
             p_refinement.append(k)
 
     while len(p_refinement) != 0:
         dg.P_refinement(p_refinement[0])
         p_refinement.pop(0)  # log(n)
-        print("Polynomial orders: {}".format(dg.N_dict))
+        print("Polynomial orders: {}".format(dg.Ns))
 
     dg.error_indicator(tol=htol)
     splitting = []
@@ -729,41 +995,456 @@ def splitting(t, T, htol, ptol, dg, printing=False, hL2_lim=0, pL2_lim=0, Kmax=4
 
     dg.error_indicator()
 
+def initial_mesh(f, tol, xk, N, Pmax=14, Kmax=40, L2_lim=None, max_depth=10, tables=None):
+    # Builds the mesh and per-element orders for the initial profile f before time stepping.
+    # Candidate elements are sampled from f directly and judged with the same spectral
+    # estimate as error_indicator - fast decay (|sigma| > 1) raises the order, slow decay
+    # bisects the element - so no split/interpolate cascade is needed at t = 0.
+    # Failing elements are refined largest estimated error first, so the Kmax budget goes to
+    # the features of f rather than to whichever elements happen to come first.
+    # L2_lim - elements with a smaller L2 norm are accepted as they are. The default, 1e-8 of
+    #          the norm of f over the mesh, keeps the relative test away from near-zero tails.
+    # xk - starting breakpoints or [a, b] pairs, N - starting order of every element.
+    # tables - optional {n: [nodes, weights]}, e.g. a solver's Nodes_and_Weights_dict, otherwise
+    #          the Gauss rules come from legendre_gauss - no solver is needed.
+    xk = Mesh().elements(xk)
+    if tables is not None:
+        Pmax = min(Pmax, max(tables))
+    rule = (lambda n: tables[n]) if tables is not None else legendre_gauss
+
+    def assess(a, b, n):
+        LGx, LGw = rule(n)
+        values = f(a + ((LGx + 1.0) / 2.0) * (b - a))
+        L2 = np.sqrt(np.sum(np.power(values, 2) * LGw))
+        slope, error = spectral_estimate(values, LGx, LGw)
+        return L2, slope, error
+
+    candidates = [(a, b, N, 0) + assess(a, b, N) for a, b in xk]
+    if L2_lim is None:
+        L2_lim = 1e-8 * np.sqrt(np.sum([np.power(el[4], 2) for el in candidates]))
+
+    # Max-heap on the estimated error - entries are (-error, counter, a, b, n, depth, slope)
+    heap = []
+    done = []
+    count = itertools.count()
+    while len(candidates) != 0:
+        for a, b, n, depth, L2, slope, error in candidates:
+            if L2 <= L2_lim or error < tol * L2:
+                done.append((a, b, n))
+            else:
+                heapq.heappush(heap, (-error, next(count), a, b, n, depth, slope))
+        candidates = []
+        if len(heap) == 0:
+            break
+
+        neg_error, num, a, b, n, depth, slope = heapq.heappop(heap)
+        if np.abs(slope) > 1.0 and n < Pmax:
+            candidates.append((a, b, n + 1, depth) + assess(a, b, n + 1))
+        elif depth < max_depth and len(done) + len(heap) + 2 <= Kmax:
+            mid = (a + b) / 2
+            candidates.append((a, mid, n, depth + 1) + assess(a, mid, n))
+            candidates.append((mid, b, n, depth + 1) + assess(mid, b, n))
+        else:
+            done.append((a, b, n))
+
+    done.sort()
+    mesh = np.array([done[0][0]] + [el[1] for el in done], dtype='double')
+    orders = np.array([el[2] for el in done], dtype='int')
+    return mesh, orders
+
 def DGStepByRK3(tn, dt, dg):
     am = np.array([0.0, -5/9, -153/128], dtype='float')
     bm = np.array([0.0, 1/3, 3/4], dtype='float')
     gm = np.array([1/3, 15/16, 8/15], dtype='float')
-    xijdt = np.zeros(dg.size, dtype='float')
-    Gj = np.zeros_like(xijdt)
+    # The RK register accumulates in float64 whatever the storage precision
+    Gj = np.zeros(dg.xij.shape, dtype='float64')
 
     for m in range(0, 3):
         t = tn + bm[m] * dt
-        ind = 0
-        for k in range(dg.K):
-            N = dg.N_dict[dg.xk[k][0]]
-            dg.Fluxes[k] = dg.fluxes(dg.xij[ind:ind+N], k) #* dg.Ji[k]
-            dg.DFluxes[k] = dg.derivativefluxes(dg.xij[ind:ind + N], k) * dg.Ji[k]
-            xijdt[ind:ind+N] = dg.DGTimeDerivative(t, k, dg.xij[ind:ind+N]) #dg.J[k]
-            ind += N
-
-        for j in range(0, dg.size):
-            Gj[j] = am[m] * Gj[j] + xijdt[j]
-            dg.xij[j] = dg.xij[j] + gm[m] * dt * Gj[j]
-        # dg.xij[0] = dg.xij[-1] = dg.g(t + dt)
+        xijdt = dg.time_derivative(t, dg.xij)[0]
+
+        Gj = am[m] * Gj + xijdt
+        dg.xij += gm[m] * dt * Gj
     return dg
 
+def DGStepByLTS(tn, H, dg, levels, history=None):
+    # One macro step of size H. Level l elements take 2^(L-l) sub-steps of the RK3 scheme,
+    # recursively finer levels first: a level computes its first stage at t0, the finer levels
+    # then cover [t0, t0 + h_l] and the level finishes its sub-step. Every stage reads its
+    # neighbours at the stage time - finer ones by quadratic Hermite interpolation of the
+    # trajectory they have just taken (sub-step end states and first-stage derivatives), coarser
+    # ones by a quadratic extrapolation of their current sub-step from u(t0), u'(t0) and
+    # u(t0 - h_prev). Neighbour values are O(h^3), the coupling error O(h^4) per sub-step in both
+    # the surface and the q volume terms, so the scheme stays third order in time. Each
+    # extrapolation spans at most one sub-step of the element it predicts, so it is as stable as
+    # that element's own step. history (a dict, e.g. held by LTSStepper) carries u(t0 - h_prev)
+    # into the next macro step - without it the first sub-step of each level extrapolates
+    # linearly. Afterwards the coarse side of every level interface is corrected so that both
+    # sides have used the same time-integrated face flux, which keeps the total mass to round-off.
+    am = np.array([0.0, -5/9, -153/128], dtype='float')
+    bm = np.array([0.0, 1/3, 3/4], dtype='float')
+    gm = np.array([1/3, 15/16, 8/15], dtype='float')
 
-from tqdm import tqdm
-def LegendreCollocationIntegrator(Nt, T, dg, split=False, tol=1.0, tol2=1.0, pL2_lim=0, hL2_lim=0, Kmax = 40, Pmax=14):
-    dt = T/Nt
+    # Effective weight of each stage in the low-storage update
+    wm = np.zeros(3)
+    for i in range(3):
+        prod = 1.0
+        for m in range(i, 3):
+            wm[i] += gm[m] * prod
+            if m + 1 < 3:
+                prod *= am[m + 1]
+
+    L = int(np.max(levels))
+    extra = dg.xij.shape[1:]
+    schedule, interfaces = lts_schedule(dg, levels)
+    history = {} if history is None else history
+    # Values every level evaluates on - its own nodes and its halo are refreshed at each stage
+    xs = dg.xij.copy()
+    # Time integral of the finer minus the coarser side's flux on each level interface face
+    reg = np.zeros((dg.K + 1,) + extra)
+
+    for level in schedule:
+        if level is not None and level.recorded_nodes is not None:
+            n = 2 ** (L - level.level)
+            level.U = np.empty((n + 1, len(level.recorded_nodes)) + extra, dtype=dg.xij.dtype)
+            level.D = np.empty((n, len(level.recorded_nodes)) + extra, dtype=dg.xij.dtype)
+            level.U[0] = dg.xij[level.recorded_nodes]
+
+    def stage(level, t, h, m, Gj):
+        nodes = level.nodes
+        xs[nodes] = dg.xij[nodes]
+        for src, cn, cp in level.coarser:
+            tau = t - src.t0
+            xs[cn] = src.u0[cp] + tau * src.d1[cp] + tau ** 2 * src.curv[cp]
+        if m == 0:
+            # The first stage runs before the finer levels move on from t
+            for src, fn, fp in level.finer:
+                xs[fn] = dg.xij[fn]
+        else:
+            for src, fn, fp in level.finer:
+                hf = H / len(src.D)
+                k = min(int((t - tn) / hf), len(src.D) - 1)
+                th = (t - tn) / hf - k
+                ua = src.U[k][fp]
+                da = hf * src.D[k][fp]
+                xs[fn] = ua + th * da + th ** 2 * (src.U[k + 1][fp] - ua - da)
+        xijdt, Fstar = dg.time_derivative(t, xs, level.plan)
+
+        Gj = am[m] * Gj + xijdt
+        dg.xij[nodes] += gm[m] * h * Gj
+        if level.interface_faces is not None:
+            # Transposed so that the sign broadcasts over any ensemble axes
+            reg[level.interface_faces] += (wm[m] * h) * (level.interface_sign * Fstar[level.interface_positions].T).T
+        return xijdt, Gj
+
+    def advance(l, t0):
+        # Levels up to l from t0 to t0 + h_l
+        h = H / 2 ** (L - l)
+        level = schedule[l]
+        if level is not None:
+            if level.predicted_nodes is not None:
+                u0 = dg.xij[level.predicted_nodes]
+            xijdt, Gj = stage(level, t0, h, 0, 0.0)
+            s = int(round((t0 - tn) / h))
+            if level.recorded_nodes is not None:
+                level.D[s] = xijdt[level.recorded_positions]
+            if level.predicted_nodes is not None:
+                d1 = xijdt[level.predicted_positions]
+                curv = np.zeros_like(d1)
+                if l in history:
+                    u_prev, h_prev = history[l]
+                    curv = (u_prev - u0 + h_prev * d1) / h_prev ** 2
+                level.t0, level.u0, level.d1, level.curv = t0, u0, d1, curv
+                history[l] = [u0, h]
+        if l > 0:
+            advance(l - 1, t0)
+            advance(l - 1, t0 + h / 2)
+        if level is not None:
+            for m in range(1, 3):
+                Gj = stage(level, t0 + bm[m] * h, h, m, Gj)[1]
+            if level.recorded_nodes is not None:
+                level.U[s + 1] = dg.xij[level.recorded_nodes]
+
+    advance(L, tn)
+
+    # Reflux - the coarse element's face term is replaced by the finer side's integral
+    for face, sl, lift in interfaces:
+        dg.xij[sl] += np.multiply.outer(lift, reg[face])
+    return dg
 
+class LTSLevel():
+    # Bookkeeping of one time step level of DGStepByLTS, built once per mesh and levels by
+    # lts_schedule. U/D (trajectory) and t0/u0/d1/curv (extrapolation) hold the working state of
+    # the current macro step.
+    def __init__(self, level, plan, elements):
+        self.level = level
+        self.plan = plan
+        self.elements = elements
+        self.nodes = plan["nodes"]
+        # Halo nodes of coarser/finer levels - [(LTSLevel, nodes, positions in its predicted/recorded nodes)]
+        self.coarser = []
+        self.finer = []
+        # Own nodes read by coarser (recorded) and finer (predicted) levels and their positions in the plan
+        self.recorded_nodes = None
+        self.recorded_positions = None
+        self.predicted_nodes = None
+        self.predicted_positions = None
+        # Level interface faces of the level, their positions in the plan and +1 (finer side) or -1
+        self.interface_faces = None
+        self.interface_positions = None
+        self.interface_sign = None
+
+def lts_schedule(dg, levels):
+    # Bookkeeping of DGStepByLTS, built once per mesh and levels - one LTSLevel per level (None
+    # when it has no elements) and, per level interface face, [face, nodes of the coarse element,
+    # lift of the flux correction onto them].
+    key = ("lts", levels.tobytes())
+    if key in dg.plans:
+        return dg.plans[key]
+    L = int(np.max(levels))
+    present = [l for l in range(L + 1) if np.any(levels == l)]
+    element_nodes = lambda ks: np.where(np.isin(dg.node_element, ks))[0]
+    schedule = [None] * (L + 1)
+    for l in present:
+        ks = np.where(levels == l)[0]
+        schedule[l] = LTSLevel(l, dg.evaluation_plan(levels == l), ks)
+
+    # Elements read by a finer and by a coarser level
+    predicted = np.zeros(dg.K, dtype='bool')
+    recorded = np.zeros(dg.K, dtype='bool')
+    for l in present:
+        E2 = schedule[l].plan["elements"]
+        predicted[E2[levels[E2] > l]] = True
+        recorded[E2[levels[E2] < l]] = True
+    for l in present:
+        level = schedule[l]
+        for name, mask in [("recorded", recorded), ("predicted", predicted)]:
+            nodes = element_nodes(np.where(mask & (levels == l))[0])
+            if len(nodes) != 0:
+                setattr(level, name + "_nodes", nodes)
+                setattr(level, name + "_positions", np.searchsorted(level.nodes, nodes))
+
+    for l in present:
+        level = schedule[l]
+        E2 = level.plan["elements"]
+        for lo in present:
+            if lo != l and np.any(levels[E2] == lo):
+                nodes = element_nodes(E2[levels[E2] == lo])
+                if lo > l:
+                    level.coarser.append((schedule[lo], nodes, np.searchsorted(schedule[lo].predicted_nodes, nodes)))
+                else:
+                    level.finer.append((schedule[lo], nodes, np.searchsorted(schedule[lo].recorded_nodes, nodes)))
+
+    # Level interfaces - face f between elements i = face_left[f] and j = face_right[f]
+    faces = np.where((dg.face_left >= 0) & (dg.face_right >= 0))[0]
+    faces = faces[levels[dg.face_left[faces]] != levels[dg.face_right[faces]]]
+    interfaces = []
+    for f in faces:
+        i, j = dg.face_left[f], dg.face_right[f]
+        k = j if levels[i] < levels[j] else i
+        N = dg.Ns[k]
+        lL, lR, dL, dR = dg.trace_operators(N)
+        LGw = dg.Nodes_and_Weights_dict[N][1]
+        lift = dg.Ji[k] * (lL / LGw if k == j else -lR / LGw)
+        interfaces.append([f, slice(dg.offsets[k], dg.offsets[k] + N), lift])
+    for l in present:
+        level = schedule[l]
+        mine = faces[(levels[dg.face_left[faces]] == l) | (levels[dg.face_right[faces]] == l)]
+        if len(mine) != 0:
+            finer = np.minimum(levels[dg.face_left[mine]], levels[dg.face_right[mine]]) == l
+            level.interface_faces = mine
+            level.interface_positions = np.searchsorted(level.plan["faces"], mine)
+            level.interface_sign = np.where(finer, 1.0, -1.0)
+    dg.plans[key] = (schedule, interfaces)
+    return dg.plans[key]
+
+def lts_cost(dg, levels, overhead=400):
+    # Predicted cost of one macro step of DGStepByLTS relative to the 2^L RK3 steps it replaces,
+    # in node evaluations - each level stage is charged its nodes and halo plus `overhead` nodes
+    # for the bookkeeping around it, which dominates on small meshes.
+    schedule, interfaces = lts_schedule(dg, levels)
+    L = int(np.max(levels))
+    work = sum(2 ** (L - level.level) * (len(level.nodes) + sum(len(n) for src, n, p in level.coarser + level.finer) + overhead)
+               for level in schedule if level is not None)
+    return work / (2 ** L * dg.size)
+
+class SolverState():
+    # Lightweight view of the solver yielded by integrate. xi/xij are read-only views of the
+    # live arrays, so they follow the solver until the next step or refinement - copy to keep.
+    def __init__(self, n, t, dg):
+        self.n = n
+        self.t = t
+        self.K = dg.K
+        self.xk = dg.xk
+        self.xi = dg.xi.view()
+        self.xi.setflags(write=False)
+        self.xij = dg.xij.view()
+        self.xij.setflags(write=False)
+        self.stopped = False
+
+def integrate(Nt, T, dg, every=None, times=None, refine=None, refine_every=None, stop=None, Pmax=14, stepper=DGStepByRK3, progress=False):
+    # Generator over the time integration with dt = T/Nt. Yields a SolverState every `every`
+    # steps, at each of `times` (the step is shortened to land on them) and at the end.
+    # refine(t, dg) is called every `refine_every` steps, e.g. a wrapper around splitting,
+    # and stop(t, dg) ends the run early when it returns True. times must lie in [0, T].
+    dt = T/Nt
     dg.Nmax = Pmax
-    for n in tqdm(np.arange(0, Nt-1)):
-        tn = (n) * dt
-        dg = DGStepByRK3(tn, dt, dg)
+    times = sorted(times) if times is not None else []
+    if len(times) != 0 and (times[0] < 0 or times[-1] > T):
+        raise ValueError("Output times must lie in [0, {}], got {}".format(T, times))
+    ti = 0
+    n = 0
+    t = 0.0
+    bar = None
+    if progress:
+        from tqdm import tqdm
+        bar = tqdm(total=Nt)
+
+    # Times at 0 are the initial state
+    if ti < len(times) and times[ti] == 0:
+        while ti < len(times) and times[ti] == 0:
+            ti += 1
+        yield SolverState(n, t, dg)
+
+    while t < T - 1e-12 * T:
+        step = min(dt, T - t)
+        if ti < len(times) and times[ti] < t + step:
+            step = times[ti] - t
+        dg = stepper(t, step, dg)
+        t += step
+        n += 1
+        if bar is not None:
+            bar.update(1)
+
+        if refine is not None and refine_every is not None and n % refine_every == 0:
+            refine(t, dg)
+
+        emit = every is not None and n % every == 0
+        while ti < len(times) and times[ti] <= t + 1e-12 * T:
+            emit = True
+            ti += 1
+        finished = t >= T - 1e-12 * T
+        stopped = stop is not None and stop(t, dg)
+
+        if emit or finished or stopped:
+            state = SolverState(n, t, dg)
+            state.stopped = stopped
+            yield state
+        if stopped:
+            break
+
+    if bar is not None:
+        bar.close()
+
+def stop_at_boundary(width=1.0):
+    # Stop condition - the solution peak (the highest over all ensemble members) is within
+    # `width` of either end of the mesh
+    def stop(t, dg):
+        x = dg.xi[np.argmax(np.max(dg.xij.reshape(dg.size, -1), axis=1))]
+        return x - dg.xk[0][0] < width or dg.xk[-1][1] - x < width
+    return stop
+
+def stop_on_error(bound, exact=None):
+    # Stop condition - the max nodal error against exact(x, t) exceeds bound, in any ensemble
+    # member. exact may return one value per node, compared with every member, or the full state.
+    if exact is None:
+        exact = analytical_solution
+    def stop(t, dg):
+        u = np.asarray(exact(dg.xi, t), dtype='float')
+        u = u.reshape(u.shape + (1,) * (dg.xij.ndim - u.ndim))
+        return np.max(np.abs(dg.xij - u)) > bound
+    return stop
+
+def stop_on_nonfinite():
+    # Stop condition - the state holds a NaN or an infinity, e.g. after a step beyond the stable limit
+    def stop(t, dg):
+        return not np.all(np.isfinite(dg.xij))
+    return stop
+
+def analytical_solution(x, t):
+    # Advected and diffused exp(-x^2) on the periodic [-8, 8] domain, as drawn by plot()
+    fReal0 = np.exp(-np.power(x-t,2)/(4.0*t+1.0))/(np.sqrt(4.0*t+1.0))
+    fReal1 = np.exp(-np.power(x+16-t,2)/(4.0*t+1.0))/(np.sqrt(4.0*t+1.0))
+    return fReal0 + fReal1
+
+def precision_report(N, xk, T, Nt, dtypes=('float64', 'float32'), exact=analytical_solution, initial_condition=None,
+                     orders=None, stepper=DGStepByRK3, refine=None, refine_every=None, Pmax=14, printing=False):
+    # Runs the same case at each storage precision and reports the max error against
+    # exact(x, t) (None skips it), the max difference from the first precision, the bytes
+    # held in the state and the operators the time derivative reads, and the run time.
+    # The difference is None when refinement has left the runs on different meshes.
+    # printing - also print the rows as a table
+    K = len(Mesh().elements(xk))
+    rows = []
+    for dtype in dtypes:
+        dg = NodalDiscontinuousGalerkin(N, K, xk, orders=orders, initial_condition=initial_condition, verbose=False,
+                                        dtype=dtype)
+        start = time.perf_counter()
+        for state in integrate(Nt, T, dg, refine=refine, refine_every=refine_every, Pmax=Pmax, stepper=stepper):
+            pass
+        elapsed = time.perf_counter() - start
+        xi = dg.node_coordinates()
+        xij = dg.xij.astype('float64')
+        stencil = dg.stencils()
+        nbytes = (dg.xij.nbytes + dg.xi.nbytes + sum(B.nbytes for B in stencil["blocks"])
+                  + stencil["face_blocks"].nbytes)
+        error = None if exact is None else float(np.max(np.abs(xij - exact(xi, T))))
+        rows.append({"dtype": str(dg.dtype), "error": error, "xij": xij, "bytes": int(nbytes), "time": elapsed})
+
+    reference = rows[0]["xij"]
+    for row in rows:
+        same = row["xij"].shape == reference.shape
+        row["difference"] = float(np.max(np.abs(row["xij"] - reference))) if same else None
+    for row in rows:
+        del row["xij"]
+    if printing:
+        number = lambda v: "{:>12}".format("-") if v is None else "{:>12.3e}".format(v)
+        print("{:>8} {:>12} {:>12} {:>10} {:>8}".format("dtype", "error", "difference", "bytes", "time"))
+        for row in rows:
+            print("{:>8} {} {} {:>10} {:>8.3f}".format(
+                row["dtype"], number(row["error"]), number(row["difference"]), row["bytes"], row["time"]))
+    return rows
+
+def LegendreCollocationIntegrator(Nt, T, dg, split=False, tol=1.0, tol2=1.0, pL2_lim=0, hL2_lim=0, Kmax = 40, Pmax=14):
+    for state in integrate(Nt, T, dg, every=max(int(np.floor(Nt/4)), 1), Pmax=Pmax, progress=True):
+        dg.plot(state.t, T)
+
+    return dg.xij, dg.xi
 
-        if n % np.floor(Nt/4) == 0:
-            dg.plot(tn, T)
+class LTSStepper():
+    # DGStepByLTS with the (tn, dt, dg) signature of DGStepByRK3, for use with integrate.
+    # dt is the macro step; levels are recomputed whenever refinement changes the mesh. When
+    # lts_cost predicts no gain (few elements, or few of them on coarse levels) the macro step
+    # is taken as 2^L RK3 steps of the finest level instead - fallback records which was chosen,
+    # and passing fallback=True/False forces either.
+    def __init__(self, max_level=4, fallback=None):
+        self.max_level = max_level
+        self.choice = fallback
+        self.levels = None
+        self.shape = None
+        self.history = {}
+        self.fallback = False
+
+    def __call__(self, tn, dt, dg):
+        if self.shape != (dg.K, dg.size):
+            self.levels = dg.time_step_levels(self.max_level)
+            self.shape = (dg.K, dg.size)
+            self.history = {}
+            self.fallback = lts_cost(dg, self.levels) >= 1 if self.choice is None else self.choice
+        if self.fallback:
+            n = 2 ** int(np.max(self.levels))
+            for i in range(n):
+                dg = DGStepByRK3(tn + i * dt / n, dt / n, dg)
+            return dg
+        return DGStepByLTS(tn, dt, dg, self.levels, self.history)
+
+def LocalTimeSteppingIntegrator(Nt, T, dg, max_level=4, Pmax=14):
+    # dt = T/Nt is the step of the finest level - coarser elements are sub-cycled less often
+    levels = dg.time_step_levels(max_level)
+    Nm = int(np.ceil(Nt / 2 ** int(np.max(levels))))
+    print("Time step levels: {}".format(levels))
+    for state in integrate(Nm, T, dg, every=max(int(np.floor(Nm/4)), 1), Pmax=Pmax, stepper=LTSStepper(max_level), progress=True):
+        dg.plot(state.t, T)
 
     return dg.xij, dg.xi
 
@@ -775,8 +1456,6 @@ if __name__ == "__main__":
 
     # Importing/ generating a 1D mesh
     from matplotlib import pyplot as plt
-    from Linear_regression import LinearRegression
-    from Kopriva_Continuous_SEM.MeshGenerator import Mesh
     mesh_obj = Mesh()
 
     mesh = mesh_obj.mesh_gen(4, -8, 8)
@@ -789,7 +1468,6 @@ if __name__ == "__main__":
     K = len(mesh)
     DG = NodalDiscontinuousGalerkin(N, K, mesh)
 
-    from tqdm import tqdm
     T = 0.0
     tol = 0.001
     tol2 = 0.0002
@@ -800,7 +1478,7 @@ if __name__ == "__main__":
         DG = NodalDiscontinuousGalerkin(N, K, mesh)
         # DG.plot(0.0, i)
         xijout, X = LegendreCollocationIntegrator((T+i)*(N)**3, T+i, DG, split=False, tol=tol, tol2 = tol2, pL2_lim=pL2_lim, hL2_lim=hL2_lim, Kmax=25, Pmax=14)
-        print(DG.N_dict)
+        print(DG.Ns)
     plt.legend()
     plt.show()
 
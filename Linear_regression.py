@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 class LinearRegression():
     def estimate_coef(self, x, y):
@@ -21,6 +20,8 @@ class LinearRegression():
 
 
     def plot_regression_line(self, x, y, b):
+        import matplotlib.pyplot as plt
+
         # plotting the actual points as scatter plot
         # print(x,y)
         plt.scatter(x, y, color="m",
@@ -1,38 +1,88 @@
 import numpy as np
-from matplotlib import pyplot as plt
 
-### Find ways to grade the elements ###
+### 1D meshes are stored as a single array of element breakpoints ###
 class Mesh():
-    def mesh_gen(self, elements, start, end):
+    def uniform(self, elements, start, end):
+        return np.linspace(start, end, elements + 1, dtype='double')
+
+    def geometric(self, elements, start, end, ratio):
+        # Each element is `ratio` times the size of the one to its left
+        if ratio == 1.0:
+            return self.uniform(elements, start, end)
+        sizes = np.power(float(ratio), np.arange(elements))
+        s = np.concatenate(([0.0], np.cumsum(sizes)))
+        x = start + (end - start) * s / s[-1]
+        x[-1] = end
+        return x
 
-        # elements = 5
-        # start = -8
-        # end = 8
+    def clustered(self, elements, start, end, centre, strength):
+        # sinh stretching - elements are concentrated around `centre`, more so for larger strength
+        if not start <= centre <= end:
+            raise ValueError("Cluster centre {} is outside [{}, {}]".format(centre, start, end))
+        if strength == 0:
+            return self.uniform(elements, start, end)
+        b = strength
+        D = (centre - start) / (end - start)
+        s = np.linspace(0.0, 1.0, elements + 1)
+        if D == 0:
+            # Limit of the formula below as the centre reaches start (A -> 0)
+            x = start + (end - start) * np.sinh(b * s) / np.sinh(b)
+        else:
+            A = (1 / (2 * b)) * np.log((1 + (np.exp(b) - 1) * D) / (1 + (np.exp(-b) - 1) * D))
+            x = start + (end - start) * D * (1 + np.sinh(b * (s - A)) / np.sinh(b * A))
+        x[0] = start
+        x[-1] = end
+        return x
 
-        mesh = []
+    def piecewise(self, specs):
+        # specs - list of (kind, elements, start, end, *args), e.g. ("geometric", 6, -3, 0, 0.8)
+        generators = {"uniform": self.uniform, "geometric": self.geometric, "clustered": self.clustered}
+        parts = []
+        for num, spec in enumerate(specs):
+            kind, elements, start, end = spec[:4]
+            if num > 0 and start != parts[-1][-1]:
+                raise ValueError("Piece {} starts at {} but the previous piece ends at {}".format(
+                    num, start, parts[-1][-1]))
+            x = generators[kind](elements, start, end, *spec[4:])
+            parts.append(x if num == 0 else x[1:])
+        return np.concatenate(parts)
 
-        dx = (end-start)/(elements)
+    def elements(self, xk):
+        # (K, 2) array of element end points from breakpoints or a list of [a, b] pairs
+        xk = np.asarray(xk, dtype='double')
+        if xk.ndim == 1:
+            return np.column_stack((xk[:-1], xk[1:]))
+        return xk
 
-        x = np.arange(start, end, dx)
-        # print(x)
-        for i in x:
-                mesh.append(np.array([i, i + (dx)], dtype='double'))
+    def geometry(self, xk):
+        # delta_x, Jacobian and inverse Jacobian for every element
+        xk = np.asarray(xk, dtype='double')
+        if xk.ndim == 1:
+            delta_x = np.diff(xk)
+        else:
+            delta_x = xk[:, 1] - xk[:, 0]
+        J = delta_x / 2
+        Ji = 1 / J
+        return delta_x, J, Ji
 
-        return mesh
+    def mesh_gen(self, elements, start, end):
+        # List of [a, b] pairs - kept for callers that build graded meshes with extend
+        return list(self.elements(self.uniform(elements, start, end)))
 
 if __name__ == "__main__":
+    from matplotlib import pyplot as plt
 
     mesh_obj = Mesh()
-    mesh = mesh_obj.mesh_gen(4, -8, -3)
-    mesh.extend(mesh_obj.mesh_gen(16, -3, 3))
-    mesh.extend(mesh_obj.mesh_gen(4, 3, 8))
+    mesh = mesh_obj.piecewise([("uniform", 4, -8, -3),
+                               ("clustered", 16, -3, 3, 0.0, 3.0),
+                               ("geometric", 4, 3, 8, 1.5)])
 
     # print(mesh)
 
     points = 5
     height = 0.6
     for i in (mesh):
-        x = np.ones(points)*i[0]
+        x = np.ones(points)*i
         y = np.arange(0,height,(height/points))
         plt.plot(x,y, linestyle='dashed')
     plt.show()
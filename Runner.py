@@ -0,0 +1,269 @@
+### Headless command-line runner.
+### Reads a JSON run config, runs the solver and writes the result, a timing profile and
+### a manifest of every parameter used, so runs can be scheduled and compared.
+###
+###   python Runner.py run.json --output runs/case1 [--profile] [--validate-precision]
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from MeshGenerator import Mesh
+import Discontinuous_SEM_AdvectionDiffusion as dgsem
+
+DEFAULTS = {
+    # mesh - {"kind": "uniform"|"geometric"|"clustered", "elements", "start", "end", ...},
+    #        {"kind": "piecewise", "pieces": [[kind, elements, start, end, *args], ...]}
+    #        or {"breakpoints": [...]}
+    "mesh": {"kind": "uniform", "elements": 4, "start": -8.0, "end": 8.0},
+    "N": 12,
+    "T": 1.0,
+    # Nt - number of (finest level) steps, defaults to T / (CFL * the smallest element_time_steps())
+    "Nt": None,
+    "CFL": 0.3,
+    # initial_condition - {"kind": "gaussian", "amplitude", "centre", "width"},
+    #                     {"kind": "sine", "amplitude", "wavenumber", "phase"}
+    #                     or {"function": "module:callable"} for any u0(x)
+    "initial_condition": {"kind": "gaussian", "amplitude": 1.0, "centre": 0.0, "width": 1.0},
+    # initial_mesh - {"tol", "L2_lim", "Kmax"} builds the mesh/orders from the initial profile
+    "initial_mesh": None,
+    # integrator - "rk3" (global step) or "lts" (local time stepping)
+    "integrator": "rk3",
+    "max_level": 4,
+    "Pmax": 14,
+    # dtype - storage precision of the state and operators ("float64" or "float32")
+    "dtype": "float64",
+    # refine - {"every", "htol", "ptol", "hL2_lim", "pL2_lim", "Kmax"}, null for no refinement
+    "refine": None,
+    # output - states are written every `every` steps and at each of `times`
+    "output": {"every": None, "times": []},
+}
+
+MESH_ARGS = {
+    "uniform": ["elements", "start", "end"],
+    "geometric": ["elements", "start", "end", "ratio"],
+    "clustered": ["elements", "start", "end", "centre", "strength"],
+}
+
+INITIAL_CONDITIONS = {
+    "gaussian": lambda x, amplitude=1.0, centre=0.0, width=1.0: amplitude * np.exp(-np.power((x - centre) / width, 2)),
+    "sine": lambda x, amplitude=1.0, wavenumber=1.0, phase=0.0: amplitude * np.sin(wavenumber * x + phase),
+}
+
+
+def load_config(path):
+    with open(path) as f:
+        user = json.load(f)
+    unknown = set(user) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown config keys: {}".format(sorted(unknown)))
+    config = dict(DEFAULTS)
+    config.update(user)
+    config["output"] = dict(DEFAULTS["output"], **(user.get("output") or {}))
+    return config
+
+
+def build_mesh(spec):
+    mesh = Mesh()
+    if "breakpoints" in spec:
+        return np.asarray(spec["breakpoints"], dtype='double')
+    if spec["kind"] == "piecewise":
+        return mesh.piecewise([tuple(piece) for piece in spec["pieces"]])
+    args = [spec[name] for name in MESH_ARGS[spec["kind"]]]
+    return getattr(mesh, spec["kind"])(*args)
+
+
+def build_initial_condition(spec):
+    if "function" in spec:
+        module, name = spec["function"].split(":")
+        return getattr(importlib.import_module(module), name)
+    if spec.get("kind") not in INITIAL_CONDITIONS:
+        raise ValueError("Unknown initial condition: {}".format(spec.get("kind")))
+    profile = INITIAL_CONDITIONS[spec["kind"]]
+    args = {key: value for key, value in spec.items() if key != "kind"}
+    return lambda x: profile(x, **args)
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() if out.returncode == 0 else None
+    except OSError:
+        return None
+
+
+def save_state(path, state, dg):
+    orders = np.array(dg.Ns, dtype='int')
+    np.savez(path, t=state.t, n=state.n, xi=np.array(state.xi), xij=np.array(state.xij),
+             xk=np.array(dg.xk), orders=orders)
+
+
+def build_problem(config):
+    # Mesh, per-element orders and initial condition of the configured run
+    mesh = build_mesh(config["mesh"])
+    f = build_initial_condition(config["initial_condition"])
+    orders = None
+    if config["initial_mesh"] is not None:
+        spec = config["initial_mesh"]
+        mesh, orders = dgsem.initial_mesh(f, spec["tol"], mesh, config["N"], Pmax=config["Pmax"],
+                                          Kmax=spec.get("Kmax", 40), L2_lim=spec.get("L2_lim"))
+    return mesh, orders, f
+
+
+def build_stepping(config, dg):
+    # Stepper and number of integrate steps, plus a record of the step integrate actually
+    # takes - for lts a macro step of 2^L finest steps. Without an Nt in the config the
+    # (finest) step is CFL times the smallest stable step estimate of the built mesh.
+    T = config["T"]
+    Nt = config["Nt"]
+    if Nt is None:
+        Nt = max(int(np.ceil(T / (config["CFL"] * np.min(dg.element_time_steps())))), 1)
+    stepping = {"Nt": Nt, "dt": T / Nt}
+    if config["integrator"] == "rk3":
+        stepper = dgsem.DGStepByRK3
+    elif config["integrator"] == "lts":
+        stepper = dgsem.LTSStepper(config["max_level"])
+        levels = dg.time_step_levels(config["max_level"])
+        L = int(np.max(levels))
+        Nt = int(np.ceil(Nt / 2 ** L))
+        # Above 1 the stepper takes RK3 steps of the finest level instead
+        stepping = {"Nt": Nt, "dt": T / Nt, "levels": L + 1, "finest_dt": T / (Nt * 2 ** L),
+                    "lts_cost": float(dgsem.lts_cost(dg, levels))}
+    else:
+        raise ValueError("Unknown integrator: {}".format(config["integrator"]))
+    return stepper, Nt, stepping
+
+
+def build_refine(config):
+    if config["refine"] is None:
+        return None, None
+    r = config["refine"]
+    T = config["T"]
+    refine = lambda t, dg: dgsem.splitting(t, T, r["htol"], r["ptol"], dg, hL2_lim=r.get("hL2_lim", 0),
+                                           pL2_lim=r.get("pL2_lim", 0), Kmax=r.get("Kmax", 40), plot=False)
+    return refine, r["every"]
+
+
+def validate_precision(config):
+    # precision_report on the configured workload - mesh, orders, profile, integrator and refinement.
+    # The analytical solution only applies to the default profile on the periodic [-8, 8] mesh.
+    mesh, orders, f = build_problem(config)
+    dg = dgsem.NodalDiscontinuousGalerkin(config["N"], len(mesh) - 1, mesh, orders=orders, initial_condition=f,
+                                          verbose=False)
+    stepper, Nt, stepping = build_stepping(config, dg)
+    refine, refine_every = build_refine(config)
+    exact = None
+    if config["initial_condition"] == DEFAULTS["initial_condition"] and mesh[0] == -8.0 and mesh[-1] == 8.0:
+        exact = dgsem.analytical_solution
+    return dgsem.precision_report(config["N"], mesh, config["T"], Nt, exact=exact, initial_condition=f, orders=orders,
+                                  stepper=stepper, refine=refine, refine_every=refine_every, Pmax=config["Pmax"])
+
+
+def run(config, output):
+    os.makedirs(output, exist_ok=True)
+    timing = {}
+    start = time.perf_counter()
+
+    t0 = time.perf_counter()
+    mesh, orders, f = build_problem(config)
+    dg = dgsem.NodalDiscontinuousGalerkin(config["N"], len(mesh) - 1, mesh, orders=orders, initial_condition=f,
+                                          verbose=False, dtype=config["dtype"])
+    timing["setup"] = time.perf_counter() - t0
+
+    T = config["T"]
+    stepper, Nt, stepping = build_stepping(config, dg)
+    refine, refine_every = build_refine(config)
+
+    t0 = time.perf_counter()
+    outputs = []
+    steps = 0
+    state = None
+    for state in dgsem.integrate(Nt, T, dg, every=config["output"]["every"], times=config["output"]["times"],
+                                 refine=refine, refine_every=refine_every, stop=dgsem.stop_on_nonfinite(),
+                                 Pmax=config["Pmax"], stepper=stepper):
+        steps = state.n
+        name = "state_{:07d}.npz".format(state.n)
+        save_state(os.path.join(output, name), state, dg)
+        outputs.append({"file": name, "n": state.n, "t": state.t, "K": state.K})
+    timing["integrate"] = time.perf_counter() - t0
+    if state is None:
+        # Nothing to integrate (T = 0) - the result is the initial state
+        state = dgsem.SolverState(0, 0.0, dg)
+    # A non-finite state ends the run - the outputs are kept, the manifest records the failure
+    status = "non-finite" if state.stopped else "finished"
+
+    t0 = time.perf_counter()
+    save_state(os.path.join(output, "result.npz"), state, dg)
+    timing["write"] = time.perf_counter() - t0
+    timing["total"] = time.perf_counter() - start
+
+    profile = {
+        "timing": timing,
+        "steps": steps,
+        "steps_per_second": steps / timing["integrate"] if timing["integrate"] > 0 else None,
+        "dof": int(dg.size),
+        "dof_steps_per_second": steps * dg.size / timing["integrate"] if timing["integrate"] > 0 else None,
+    }
+    with open(os.path.join(output, "profile.json"), "w") as f:
+        json.dump(profile, f, indent=2)
+
+    manifest = {
+        "config": config,
+        "status": status,
+        "steps": steps,
+        "stepping": stepping,
+        "final": {"t": state.t, "K": int(dg.K), "dof": int(dg.size),
+                  "orders": [int(N) for N in dg.Ns]},
+        "outputs": outputs,
+        "argv": sys.argv,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "git_revision": git_revision(),
+        "finished": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    with open(os.path.join(output, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    if status != "finished":
+        raise RuntimeError("The state became non-finite at t = {} (step {}) - reduce the step with Nt or CFL"
+                           .format(state.t, state.n))
+    return profile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the DG advection-diffusion solver from a config file.")
+    parser.add_argument("config", help="JSON run config")
+    parser.add_argument("--output", default=None, help="output directory (default: runs/<config name>)")
+    parser.add_argument("--profile", action="store_true", help="also write cProfile statistics to profile.prof")
+    parser.add_argument("--validate-precision", action="store_true",
+                        help="compare float64 and float32 against the analytical solution and write precision.json")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    output = args.output
+    if output is None:
+        output = os.path.join("runs", os.path.splitext(os.path.basename(args.config))[0])
+
+    if args.validate_precision:
+        os.makedirs(output, exist_ok=True)
+        rows = validate_precision(config)
+        with open(os.path.join(output, "precision.json"), "w") as f:
+            json.dump(rows, f, indent=2)
+
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profile = profiler.runcall(run, config, output)
+        profiler.dump_stats(os.path.join(output, "profile.prof"))
+    else:
+        profile = run(config, output)
+    print("Finished {} steps in {:.3f}s -> {}".format(profile["steps"], profile["timing"]["integrate"], output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+### Long-lived local job service for many short solver runs.
+### Jobs go through an in-process asyncio queue; compatible jobs (same mesh, orders and
+### time stepping) are stacked into one ensemble run, and the operator tables stay warm
+### in OPERATOR_TABLES for the life of the process.
+
+import asyncio
+import itertools
+import time
+import numpy as np
+from Discontinuous_SEM_AdvectionDiffusion import NodalDiscontinuousGalerkin, integrate
+
+
+class SolverJob():
+    def __init__(self, mesh, N, T, Nt, initial_condition, orders=None, every=None, Pmax=14, dtype='float64'):
+        # mesh - breakpoints or [a, b] pairs, initial_condition - callable u0(x)
+        # every - also stream the state every `every` steps, otherwise only the final result
+        self.mesh = np.asarray(mesh, dtype='double')
+        self.N = N
+        self.T = T
+        self.Nt = Nt
+        self.initial_condition = initial_condition
+        self.orders = None if orders is None else np.asarray(orders, dtype='int')
+        self.every = every
+        self.Pmax = Pmax
+        self.dtype = np.dtype(dtype)
+        self.job_id = None
+
+    def batch_key(self):
+        # Jobs with equal keys can share one ensemble run
+        orders = None if self.orders is None else tuple(self.orders)
+        return (self.mesh.shape, self.mesh.tobytes(), self.N, orders, self.T, self.Nt, self.every, self.Pmax, str(self.dtype))
+
+
+class SolverResult():
+    def __init__(self, job_id, t, xi, xij, final, elapsed, batch_size):
+        self.job_id = job_id
+        self.t = t
+        self.xi = xi
+        self.xij = xij
+        self.final = final
+        self.elapsed = elapsed
+        self.batch_size = batch_size
+
+
+class SolverService():
+    def __init__(self, max_batch=32, batch_window=0.005, warm_orders=(8,)):
+        # batch_window - seconds to wait for more compatible jobs after the first one arrives
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.warm_orders = warm_orders
+        self.ids = itertools.count()
+        self.queue = None
+        self.results = None
+        self.futures = {}
+        self.worker = None
+        self.streaming = False
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.results = asyncio.Queue()
+        # Building a throwaway solver fills OPERATOR_TABLES before the first job arrives
+        for N in self.warm_orders:
+            await loop.run_in_executor(None, self.warm, N)
+        self.worker = asyncio.create_task(self.run())
+
+    def warm(self, N):
+        NodalDiscontinuousGalerkin(N, 1, np.array([-1.0, 1.0]), verbose=False)
+
+    async def stop(self):
+        if self.worker is not None:
+            await self.queue.join()
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+    async def submit(self, job):
+        # Returns a future resolving to the final SolverResult of this job
+        job.job_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.futures[job.job_id] = future
+        await self.queue.put(job)
+        return future
+
+    async def stream(self):
+        # Yields SolverResults (intermediate and final) as batches produce them.
+        # Results are only queued for streaming once a consumer has asked for them.
+        self.streaming = True
+        while True:
+            result = await self.results.get()
+            yield result
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.queue.get()]
+            await asyncio.sleep(self.batch_window)
+            while len(jobs) < self.max_batch and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+
+            batches = {}
+            for job in jobs:
+                batches.setdefault(job.batch_key(), []).append(job)
+
+            for batch in batches.values():
+                try:
+                    await loop.run_in_executor(None, self.run_batch, batch, loop)
+                except Exception as e:
+                    for job in batch:
+                        self.fail(job, e)
+            for job in jobs:
+                self.queue.task_done()
+
+    def run_batch(self, batch, loop):
+        # Runs in an executor thread - results are handed back to the event loop
+        start = time.perf_counter()
+        job = batch[0]
+        K = len(job.mesh) - 1 if job.mesh.ndim == 1 else len(job.mesh)
+        dg = NodalDiscontinuousGalerkin(job.N, K, job.mesh, orders=job.orders, verbose=False, dtype=job.dtype)
+
+        # Each member's initial condition is evaluated on its own, so a job that raises
+        # only fails itself and the rest of the ensemble still runs
+        xi = dg.node_coordinates()
+        members = []
+        for j in batch:
+            try:
+                u0 = np.asarray(j.initial_condition(xi), dtype='float')
+                if u0.shape != xi.shape:
+                    raise ValueError("initial_condition returned shape {} for {} nodes".format(u0.shape, len(xi)))
+            except Exception as e:
+                loop.call_soon_threadsafe(self.fail, j, e)
+                continue
+            members.append((j, u0))
+        if len(members) == 0:
+            return
+        batch = [j for j, u0 in members]
+        M = len(batch)
+        dg.xij = np.stack([u0 for j, u0 in members], axis=1).astype(dg.dtype)
+        dg.init_cond = dg.xij
+
+        for state in integrate(job.Nt, job.T, dg, every=job.every, Pmax=job.Pmax):
+            final = state.t >= job.T - 1e-12 * job.T
+            elapsed = time.perf_counter() - start
+            for m, j in enumerate(batch):
+                result = SolverResult(j.job_id, state.t, np.array(state.xi), np.array(state.xij[:, m]), final, elapsed, M)
+                loop.call_soon_threadsafe(self.publish, result)
+
+    def fail(self, job, error):
+        future = self.futures.pop(job.job_id, None)
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+    def publish(self, result):
+        if self.streaming:
+            self.results.put_nowait(result)
+        if result.final:
+            future = self.futures.pop(result.job_id, None)
+            if future is not None and not future.done():
+                future.set_result(result)
+
+
+async def main():
+    service = SolverService()
+    await service.start()
+    mesh = np.linspace(-8, 8, 5)
+
+    start = time.perf_counter()
+    futures = []
+    for a in np.linspace(-1, 1, 8):
+        job = SolverJob(mesh, 8, 0.5, 256, lambda x, a=a: np.exp(-np.power(x - a, 2)))
+        futures.append(await service.submit(job))
+    for future in asyncio.as_completed(futures):
+        result = await future
+        print("job {}: t={} max={:.5f} batch={} ({:.3f}s)".format(
+            result.job_id, np.round(result.t, 2), np.max(result.xij), result.batch_size, result.elapsed))
+    print("Total: {:.3f}s".format(time.perf_counter() - start))
+    await service.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from Discontinuous_SEM_AdvectionDiffusion import NodalDiscontinuousGalerkin, integrate
+
+# u = e^-t cos x on [0, 2 pi] - u_x vanishes at both ends, so it also satisfies the Neumann
+# and outflow conditions, and the source makes it exact for any constant c and nu
+NU = 0.2
+
+
+def exact(x, t):
+    return np.exp(-t) * np.cos(x)
+
+
+def solve(N, bc, advective, diffusive, c, T=0.5):
+    dg = NodalDiscontinuousGalerkin(N, 4, np.linspace(0, 2 * np.pi, 5), initial_condition=lambda x: exact(x, 0), verbose=False)
+    values = {"dirichlet": lambda t: np.exp(-t), "neumann": 0.0, "outflow": 0.0, "periodic": 0.0}
+    dg.set_boundary(bc[0], bc[1], values[bc[0]], values[bc[1]])
+    dg.set_fluxes(advective, diffusive, penalty=2.0)
+    dg.set_coefficients(c=c, nu=NU, source=lambda x, t: np.exp(-t) * ((NU - 1) * np.cos(x) - c * np.sin(x)))
+    Nt = int(np.ceil(T / (0.3 * np.min(dg.element_time_steps()))))
+    for state in integrate(Nt, T, dg):
+        pass
+    return np.max(np.abs(dg.xij - exact(dg.xi, T)))
+
+
+@pytest.mark.parametrize("bc, c", [(("periodic", "periodic"), 0.5), (("periodic", "periodic"), -0.5),
+                                   (("dirichlet", "dirichlet"), 0.5), (("dirichlet", "dirichlet"), -0.5),
+                                   (("neumann", "neumann"), 0.5), (("dirichlet", "outflow"), 0.5),
+                                   (("outflow", "dirichlet"), -0.5), (("outflow", "outflow"), 0.0)])
+@pytest.mark.parametrize("advective", ["upwind", "central"])
+@pytest.mark.parametrize("diffusive", ["ldg", "central", "ip"])
+def test_boundary_and_flux_pairs_converge_spectrally(bc, c, advective, diffusive):
+    coarse = solve(4, bc, advective, diffusive, c)
+    fine = solve(8, bc, advective, diffusive, c)
+    assert coarse < 5e-3
+    assert fine < 1e-7
+
+
+@pytest.mark.parametrize("diffusive", ["ldg", "central", "ip"])
+def test_outflow_diffusion_is_not_growing(diffusive):
+    # Pure diffusion with outflow on both ends - every eigenvalue of the operator has Re <= 0
+    dg = NodalDiscontinuousGalerkin(6, 8, np.linspace(-8, 8, 9), verbose=False)
+    dg.set_boundary("outflow", "outflow")
+    dg.set_fluxes("upwind", diffusive)
+    dg.set_coefficients(c=0.0, nu=1.0)
+    A = np.array([dg.time_derivative(0.0, e)[0] for e in np.eye(dg.size)]).T
+    assert np.max(np.linalg.eigvals(A).real) < 1e-10
+
+
+def test_set_boundary_and_set_fluxes_reject_unknown_kinds():
+    dg = NodalDiscontinuousGalerkin(4, 2, np.linspace(-1, 1, 3), verbose=False)
+    with pytest.raises(ValueError):
+        dg.set_boundary("reflecting", "outflow")
+    with pytest.raises(ValueError):
+        dg.set_boundary("periodic", "outflow")
+    with pytest.raises(ValueError):
+        dg.set_fluxes("downwind")
+    with pytest.raises(ValueError):
+        dg.set_fluxes("upwind", "bassi-rebay")
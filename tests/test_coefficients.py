@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from Discontinuous_SEM_AdvectionDiffusion import NodalDiscontinuousGalerkin, integrate
+
+# u = e^-t sin x with c = 1 + sin(x)/2 and nu = 1 + cos(x)/2 on a periodic [0, 2 pi] - the
+# source u_t + (c u)_x - (nu u_x)_x = e^-t (cos x + sin 2x) makes it exact
+c = lambda x: 1 + 0.5 * np.sin(x)
+nu = lambda x: 1 + 0.5 * np.cos(x)
+source = lambda x, t: np.exp(-t) * (np.cos(x) + np.sin(2 * x))
+
+
+def solver(N):
+    return NodalDiscontinuousGalerkin(N, 4, np.linspace(0, 2 * np.pi, 5), initial_condition=np.sin, verbose=False)
+
+
+def error(dg, T=0.1):
+    Nt = int(np.ceil(T / (0.3 * np.min(dg.element_time_steps()))))
+    for state in integrate(Nt, T, dg):
+        pass
+    return np.max(np.abs(dg.xij - np.exp(-T) * np.sin(dg.xi)))
+
+
+def test_variable_coefficients_converge_to_the_manufactured_solution():
+    errors = []
+    for N in [8, 12]:
+        dg = solver(N)
+        dg.set_coefficients(c=c, nu=nu, source=source)
+        errors.append(error(dg))
+    assert errors[0] < 1e-6
+    assert errors[1] < 1e-12
+
+
+def test_nodal_coefficients_follow_h_and_p_refinement():
+    dg = solver(12)
+    dg.set_coefficients(c=c(dg.xi), nu=nu(dg.xi), source=source)
+    dg.element_split(1)
+    dg.P_refinement(3)
+    assert dg.K == 5 and dg.Ns[3] == 13
+    assert np.max(np.abs(dg.c - c(dg.xi))) < 1e-12
+    assert np.max(np.abs(dg.nu - nu(dg.xi))) < 1e-12
+    assert error(dg) < 1e-12
+
+
+def test_rejected_coefficients_leave_the_solver_unchanged():
+    dg = solver(6)
+    dg.set_coefficients(c=2.0, nu=0.5)
+    with pytest.raises(ValueError):
+        dg.set_coefficients(c=np.ones(dg.size - 1))
+    with pytest.raises(ValueError):
+        dg.set_coefficients(c=1.0, nu=lambda x: np.ones((2, len(x))))
+    assert dg.c == 2.0 and dg.nu == 0.5
+    udot = dg.time_derivative(0.0, dg.xij)[0]
+    assert np.all(np.isfinite(udot))
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from Discontinuous_SEM_AdvectionDiffusion import (NodalDiscontinuousGalerkin, initial_mesh, legendre_basis, legendre_gauss,
+                                                   modal_table, spectral_estimate)
+from MeshGenerator import Mesh
+
+XK = np.linspace(-8, 8, 5)
+
+
+def interpolation_error(f, mesh, orders):
+    # Max error of the nodal interpolant of f on each element, sampled between the nodes
+    s = np.linspace(-1.0, 1.0, 50)
+    error = 0.0
+    for (a, b), n in zip(Mesh().elements(mesh), orders):
+        LGx, LGw = legendre_gauss(n)
+        an = modal_table(LGx, LGw) @ f(a + (LGx + 1.0) / 2.0 * (b - a))
+        u = legendre_basis(n - 1, s)[0].T @ an
+        error = max(error, np.max(np.abs(u - f(a + (s + 1.0) / 2.0 * (b - a)))))
+    return error
+
+
+@pytest.mark.parametrize("width", [1.0, 50.0])
+def test_initial_mesh_resolves_the_profile(width):
+    f = lambda x: np.exp(-width * np.power(x, 2))
+    mesh, orders = initial_mesh(f, 1e-4, XK, 8, Kmax=20)
+    assert len(orders) <= 20
+    assert np.all(np.diff(mesh) > 0)
+    assert mesh[0] == -8.0 and mesh[-1] == 8.0
+    assert interpolation_error(f, mesh, orders) < 1e-3
+
+
+def test_initial_mesh_leaves_the_tails_coarse():
+    mesh, orders = initial_mesh(lambda x: np.exp(-50 * np.power(x, 2)), 1e-4, XK, 8, Kmax=20)
+    dx = np.diff(mesh)
+    assert dx[0] == 4.0 and dx[-1] == 4.0
+
+
+def test_solver_tables_give_the_same_mesh():
+    dg = NodalDiscontinuousGalerkin(8, 4, XK, verbose=False)
+    f = lambda x: np.exp(-50 * np.power(x, 2))
+    mesh, orders = initial_mesh(f, 1e-4, XK, 8, Kmax=20)
+    shared, shared_orders = initial_mesh(f, 1e-4, XK, 8, Kmax=20, tables=dg.Nodes_and_Weights_dict)
+    assert np.array_equal(mesh, shared) and np.array_equal(orders, shared_orders)
+
+
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+@pytest.mark.parametrize("values", [np.zeros(8), np.ones(8), np.full(8, 1e-300)])
+def test_flat_spectra_give_finite_estimates(values):
+    slope, error = spectral_estimate(values, *legendre_gauss(8))
+    assert np.isfinite(slope) and np.isfinite(error)
+    assert error <= np.max(np.abs(values))
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from Discontinuous_SEM_AdvectionDiffusion import NodalDiscontinuousGalerkin, integrate, stop_at_boundary, stop_on_error
+
+
+@pytest.fixture
+def dg():
+    return NodalDiscontinuousGalerkin(8, 4, np.linspace(-8, 8, 5), verbose=False)
+
+
+@pytest.mark.parametrize("times", [[-0.01], [0.2, 0.6]])
+def test_integrate_rejects_times_outside_the_run(dg, times):
+    with pytest.raises(ValueError):
+        list(integrate(100, 0.5, dg, times=times))
+
+
+def test_integrate_lands_on_requested_times(dg):
+    states = [(state.n, state.t) for state in integrate(100, 0.5, dg, times=[0.0, 0.123, 0.25])]
+    assert states[0] == (0, 0.0)
+    assert np.allclose([t for n, t in states], [0.0, 0.123, 0.25, 0.5])
+
+
+def ensemble(centres):
+    return lambda x: np.stack([np.exp(-np.power(x - c, 2)) for c in centres], axis=1)
+
+
+@pytest.mark.parametrize("centre, stopped", [(1.0, False), (6.5, True), (-6.5, True)])
+def test_stop_at_boundary_follows_every_member(centre, stopped):
+    # The second member holds the highest node, the first one's lower peak stays at 0
+    dg = NodalDiscontinuousGalerkin(8, 8, np.linspace(-8, 8, 9), initial_condition=ensemble([0.0, centre]), verbose=False)
+    dg.xij[:, 0] *= 0.5
+    assert stop_at_boundary(2.0)(0.0, dg) == stopped
+
+
+def test_stop_on_error_compares_every_member():
+    dg = NodalDiscontinuousGalerkin(8, 4, np.linspace(-8, 8, 5), initial_condition=ensemble([0.0, 0.0, 0.0]), verbose=False)
+    exact = lambda x, t: np.exp(-np.power(x, 2))
+    assert not stop_on_error(1e-6, exact)(0.0, dg)
+    dg.xij[3, 2] += 1e-3
+    assert stop_on_error(1e-6, exact)(0.0, dg)
+    assert not stop_on_error(1e-6, lambda x, t: dg.xij.copy())(0.0, dg)
+
+
+def test_stop_on_error_ends_an_ensemble_run():
+    dg = NodalDiscontinuousGalerkin(8, 4, np.linspace(-8, 8, 5), initial_condition=ensemble([0.0, 0.0]), verbose=False)
+    states = list(integrate(100, 0.5, dg, stop=stop_on_error(1e-3, lambda x, t: np.exp(-np.power(x, 2)))))
+    assert states[-1].stopped and states[-1].t < 0.5
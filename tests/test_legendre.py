@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from numpy.polynomial import legendre
+from Discontinuous_SEM_AdvectionDiffusion import NodalDiscontinuousGalerkin, legendre_basis
+
+
+def test_legendre_basis_matches_numpy():
+    x = np.linspace(-1, 1, 41)
+    P, dP = legendre_basis(16, x)
+    for n in range(17):
+        coefficients = np.eye(17)[n]
+        assert np.allclose(P[n], legendre.legval(x, coefficients), rtol=0, atol=1e-13)
+        assert np.allclose(dP[n], legendre.legval(x, legendre.legder(coefficients)), rtol=0, atol=1e-11)
+
+
+@pytest.mark.parametrize("N", range(1, 17))
+def test_gauss_nodes_and_weights_match_numpy(N):
+    dg = NodalDiscontinuousGalerkin(4, 1, np.array([-1.0, 1.0]), verbose=False)
+    x, w = dg.LegendreGaussNodesAndWeights(N)
+    nodes, weights = legendre.leggauss(N)
+    assert np.allclose(x, nodes, rtol=0, atol=1e-14)
+    assert np.allclose(w, weights, rtol=0, atol=1e-13)
@@ -0,0 +1,84 @@
+import time
+import numpy as np
+import pytest
+from Discontinuous_SEM_AdvectionDiffusion import NodalDiscontinuousGalerkin, DGStepByRK3, LTSStepper, integrate, lts_cost
+from MeshGenerator import Mesh
+
+
+def graded_solver(scale=1):
+    # Five levels on a periodic mesh graded towards 0, with scale times the elements per part
+    r = 2.0 ** (1 / scale)
+    xk = Mesh().piecewise([("uniform", 6 * scale, -8, -1), ("geometric", 5 * scale, -1, 0, 1 / r),
+                           ("geometric", 5 * scale, 0, 1, r), ("uniform", 6 * scale, 1, 8)])
+    dg = NodalDiscontinuousGalerkin(6, len(xk) - 1, xk, verbose=False)
+    dg.set_coefficients(c=1.0, nu=0.02)
+    return dg
+
+
+def mass(dg):
+    return sum(np.sum(dg.Nodes_and_Weights_dict[N][1] * dg.xij[idx] / dg.Ji[ks][:, None]) for N, ks, idx in dg.groups)
+
+
+@pytest.fixture(scope="module")
+def run():
+    dg = graded_solver()
+    levels = dg.time_step_levels(4)
+    assert np.max(levels) == 4
+    T = 256 * 0.3 * np.min(dg.element_time_steps())
+
+    reference = graded_solver()
+    for state in integrate(32 * 16, T, reference):
+        pass
+
+    def lts(Nm):
+        dg = graded_solver()
+        m0 = mass(dg)
+        for state in integrate(Nm, T, dg, stepper=LTSStepper(4, fallback=False)):
+            pass
+        return np.max(np.abs(dg.xij - reference.xij)), mass(dg) - m0
+    return lts
+
+
+def test_lts_conserves_mass(run):
+    assert abs(run(8)[1]) < 1e-13
+
+
+def test_lts_is_third_order_against_rk3(run):
+    coarse = run(8)[0]
+    fine = run(16)[0]
+    assert fine < coarse / 6
+    assert fine < 1e-9
+
+
+def test_small_meshes_fall_back_to_rk3():
+    dg = graded_solver()
+    assert lts_cost(dg, dg.time_step_levels(4)) > 1
+    stepper = LTSStepper(4)
+    reference = graded_solver()
+    dt = 0.3 * np.min(dg.element_time_steps())
+    for state in integrate(2, 32 * dt, dg, stepper=stepper):
+        pass
+    for state in integrate(32, 32 * dt, reference):
+        pass
+    assert stepper.fallback
+    assert np.max(np.abs(dg.xij - reference.xij)) < 1e-13
+
+
+def test_lts_outruns_rk3_on_a_large_graded_mesh():
+    dg = graded_solver(40)
+    levels = dg.time_step_levels(4)
+    assert np.max(levels) == 4 and lts_cost(dg, levels) < 0.5
+    T = 32 * 0.3 * np.min(dg.element_time_steps())
+    elapsed = {}
+    for name, Nt, stepper in [("rk3", 32, DGStepByRK3), ("lts", 2, LTSStepper(4))]:
+        # Best of three, so that the stencil and schedule assembly of the first run is not timed
+        dg = graded_solver(40)
+        runs = []
+        for repeat in range(3):
+            start = time.perf_counter()
+            for state in integrate(Nt, T, dg, stepper=stepper):
+                pass
+            runs.append(time.perf_counter() - start)
+        elapsed[name] = min(runs)
+    assert not stepper.fallback
+    assert elapsed["lts"] < elapsed["rk3"] / 1.5
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from MeshGenerator import Mesh
+
+
+@pytest.mark.parametrize("centre", [-8.0, -3.0, 0.0, 5.0, 8.0])
+def test_clustered_is_finite_and_monotone(centre):
+    x = Mesh().clustered(10, -8.0, 8.0, centre, 3.0)
+    assert np.all(np.isfinite(x))
+    assert x[0] == -8.0 and x[-1] == 8.0
+    assert np.all(np.diff(x) > 0)
+
+
+@pytest.mark.parametrize("centre, element", [(-8.0, 0), (8.0, -1)])
+def test_clustered_end_point_centre_refines_that_end(centre, element):
+    dx = np.diff(Mesh().clustered(10, -8.0, 8.0, centre, 3.0))
+    assert dx[element] == np.min(dx)
+
+
+def test_clustered_rejects_centre_outside_the_interval():
+    with pytest.raises(ValueError):
+        Mesh().clustered(10, -8.0, 8.0, 9.0, 3.0)
@@ -0,0 +1,55 @@
+import numpy as np
+from Discontinuous_SEM_AdvectionDiffusion import NodalDiscontinuousGalerkin, DGStepByRK3, integrate, precision_report
+
+
+def solver(dtype):
+    return NodalDiscontinuousGalerkin(8, 4, np.linspace(-8, 8, 5), verbose=False, dtype=dtype)
+
+
+def test_float32_run_stays_in_float32():
+    dg = solver("float32")
+    for state in integrate(50, 0.05, dg):
+        pass
+    assert dg.xij.dtype == np.float32
+    stencil = dg.stencils()
+    assert all(B.dtype == np.float32 for B in stencil["blocks"])
+    assert stencil["face_blocks"].dtype == np.float32
+    udot, Fstar = dg.time_derivative(0.0, dg.xij)
+    assert udot.dtype == np.float32 and Fstar.dtype == np.float32
+
+
+class Additions(np.ndarray):
+    # Records the dtype of everything added in place
+    seen = []
+
+    def __iadd__(self, other):
+        Additions.seen.append(np.asarray(other).dtype)
+        return super().__iadd__(other)
+
+
+def test_rk_register_accumulates_in_float64():
+    dg = solver("float32")
+    dg.xij = dg.xij.view(Additions)
+    Additions.seen = []
+    DGStepByRK3(0.0, 1e-3, dg)
+    assert dg.xij.dtype == np.float32
+    assert Additions.seen == [np.float64] * 3
+
+
+def test_indicator_is_evaluated_in_float64():
+    single = solver("float32")
+    double = solver("float64")
+    double.xij = single.xij.astype("float64")
+    single.error_indicator()
+    double.error_indicator()
+    assert np.allclose(single.errors, double.errors, rtol=1e-12, atol=0)
+    assert np.allclose(single.sigmas, double.sigmas, rtol=1e-12, atol=0)
+
+
+def test_precision_report_prints_only_on_request(capsys):
+    rows = precision_report(6, np.linspace(-8, 8, 5), 0.01, 10)
+    assert capsys.readouterr().out == ""
+    assert [row["dtype"] for row in rows] == ["float64", "float32"]
+    assert rows[1]["bytes"] < rows[0]["bytes"]
+    precision_report(6, np.linspace(-8, 8, 5), 0.01, 10, printing=True)
+    assert "float32" in capsys.readouterr().out
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from Discontinuous_SEM_AdvectionDiffusion import NodalDiscontinuousGalerkin
+
+XK = np.linspace(-8, 8, 5)
+
+
+def cubic(x):
+    return 0.01 * x ** 3 - 0.2 * x + 1
+
+
+def test_refinement_keeps_polynomials_exactly():
+    dg = NodalDiscontinuousGalerkin(6, 4, XK, initial_condition=cubic, verbose=False)
+    dg.element_split(2)
+    dg.P_refinement(0)
+    dg.P_refinement(0)
+    assert dg.K == 5 and list(dg.Ns) == [8, 6, 6, 6, 6]
+    assert dg.xij.shape == dg.xi.shape == (dg.size,)
+    assert np.max(np.abs(dg.xij - cubic(dg.xi))) < 1e-12
+
+
+def test_refinement_moves_every_ensemble_member():
+    ensemble = lambda x: np.stack([cubic(x), np.sin(x), np.exp(-x ** 2)], axis=1)
+    dg = NodalDiscontinuousGalerkin(8, 4, XK, initial_condition=ensemble, verbose=False)
+    members = [NodalDiscontinuousGalerkin(8, 4, XK, initial_condition=lambda x, m=m: ensemble(x)[:, m], verbose=False)
+               for m in range(3)]
+    for solver in [dg] + members:
+        solver.element_split(1)
+        solver.P_refinement(3)
+    assert dg.xij.shape == (dg.size, 3)
+    for m, member in enumerate(members):
+        assert np.allclose(dg.xij[:, m], member.xij, rtol=0, atol=1e-14)
+
+
+def test_element_count_must_match_the_mesh():
+    with pytest.raises(ValueError):
+        NodalDiscontinuousGalerkin(6, 5, XK, verbose=False)
@@ -0,0 +1,66 @@
+import json
+import numpy as np
+import pytest
+import Runner
+
+
+def config(tmp_path, **user):
+    path = tmp_path / "run.json"
+    path.write_text(json.dumps(user))
+    return Runner.load_config(str(path))
+
+
+def manifest(output):
+    with open(output / "manifest.json") as f:
+        return json.load(f)
+
+
+def test_default_step_follows_the_mesh(tmp_path):
+    cfg = config(tmp_path, mesh={"kind": "geometric", "elements": 6, "start": -8, "end": 8, "ratio": 2.0}, N=6, T=0.05)
+    Runner.run(cfg, tmp_path / "out")
+    record = manifest(tmp_path / "out")
+    mesh = Runner.build_mesh(cfg["mesh"])
+    dg = Runner.dgsem.NodalDiscontinuousGalerkin(6, len(mesh) - 1, mesh, verbose=False)
+    assert record["status"] == "finished"
+    assert record["stepping"]["dt"] <= cfg["CFL"] * np.min(dg.element_time_steps())
+    assert np.all(np.isfinite(np.load(tmp_path / "out" / "result.npz")["xij"]))
+
+
+def test_lts_default_step_is_the_finest_level(tmp_path):
+    cfg = config(tmp_path, mesh={"kind": "geometric", "elements": 4, "start": -8, "end": 8, "ratio": 3.0}, N=6,
+                 T=0.05, integrator="lts")
+    Runner.run(cfg, tmp_path / "out")
+    record = manifest(tmp_path / "out")
+    assert record["status"] == "finished"
+    assert record["stepping"]["levels"] > 1
+    assert np.all(np.isfinite(np.load(tmp_path / "out" / "result.npz")["xij"]))
+
+
+def test_initial_mesh_run_stays_finite(tmp_path):
+    cfg = config(tmp_path, N=8, T=0.02, initial_mesh={"tol": 1e-4, "Kmax": 12},
+                 initial_condition={"kind": "gaussian", "width": 0.3})
+    Runner.run(cfg, tmp_path / "out")
+    assert np.max(np.abs(np.load(tmp_path / "out" / "result.npz")["xij"])) < 2
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_non_finite_state_fails_the_run(tmp_path):
+    # Steps of 1.0 on N = 12 are far beyond the stable limit and overflow within 40 steps
+    cfg = config(tmp_path, N=12, T=100.0, Nt=100)
+    with pytest.raises(RuntimeError):
+        Runner.run(cfg, tmp_path / "out")
+    record = manifest(tmp_path / "out")
+    assert record["status"] == "non-finite"
+    assert record["final"]["t"] < 100.0
+
+
+def test_zero_length_run_writes_the_initial_state(tmp_path):
+    cfg = config(tmp_path, N=6, T=0.0)
+    Runner.run(cfg, tmp_path / "out")
+    assert manifest(tmp_path / "out")["steps"] == 0
+    assert np.load(tmp_path / "out" / "result.npz")["t"] == 0.0
+
+
+def test_unknown_config_keys_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        config(tmp_path, Nsteps=10)
@@ -0,0 +1,27 @@
+import asyncio
+import numpy as np
+import pytest
+from SolverService import SolverJob, SolverService
+
+
+def bad_initial_condition(x):
+    raise RuntimeError("bad profile")
+
+
+def test_failing_initial_condition_only_fails_its_own_job():
+    async def run():
+        service = SolverService(warm_orders=())
+        await service.start()
+        mesh = np.linspace(-8, 8, 5)
+        good = [await service.submit(SolverJob(mesh, 6, 0.05, 20, lambda x, a=a: np.exp(-np.power(x - a, 2))))
+                for a in [-1.0, 1.0]]
+        bad = await service.submit(SolverJob(mesh, 6, 0.05, 20, bad_initial_condition))
+        results = await asyncio.gather(*good)
+        with pytest.raises(RuntimeError):
+            await bad
+        await service.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert [result.batch_size for result in results] == [2, 2]
+    assert all(result.final and np.all(np.isfinite(result.xij)) for result in results)